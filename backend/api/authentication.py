@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from copy import copy
+from threading import Lock
+from time import monotonic, time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+TOKEN_CACHE_CHANGED_KEY = 'token_cache_changed_{user_id}'
+
+
+class TokenCache:
+    """LRU-кэш токенов с ограниченным временем жизни записей.
+
+    Время последнего изменения пользователя (выход, изменение, удаление)
+    хранится в кэше Django: записи этого пользователя, прочитанные из БД
+    раньше, не используются ни в одном процессе. Записи остальных
+    пользователей остаются в кэше.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[1] > monotonic():
+            credentials, _, fetched_at = entry
+            changed_at = cache.get(TOKEN_CACHE_CHANGED_KEY.format(
+                user_id=credentials[0].id
+            ))
+            if changed_at is None or changed_at < fetched_at:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return credentials
+        with self._lock:
+            self._entries.pop(key, None)
+            self.misses += 1
+        return None
+
+    def set(self, key, credentials, fetched_at):
+        """Сохраняет данные, прочитанные из БД начиная с fetched_at."""
+        with self._lock:
+            self._entries[key] = (
+                credentials, monotonic() + self.timeout, fetched_at
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        # Записи живут не дольше timeout, дольше хранить отметку не нужно.
+        cache.set(
+            TOKEN_CACHE_CHANGED_KEY.format(user_id=user_id), time(),
+            self.timeout
+        )
+        with self._lock:
+            for key in [
+                key for key, (credentials, _, _) in self._entries.items()
+                if credentials[0].id == user_id
+            ]:
+                del self._entries[key]
+
+    def get_stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0,
+            'size': len(self._entries),
+        }
+
+
+token_cache = TokenCache(
+    settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TIMEOUT
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену без запроса к БД при попадании в кэш.
+
+    Счётчики пользователя в кэш не попадают: они меняются без сохранения
+    пользователя, поэтому читаются из БД при обращении и не записываются
+    при user.save().
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            fetched_at = time()
+            user, token = super().authenticate_credentials(key)
+            for field in user.counter_fields:
+                vars(user).pop(field, None)
+            credentials = (user, token)
+            token_cache.set(key, credentials, fetched_at)
+        user, token = credentials
+        return copy(user), token
@@ -0,0 +1,117 @@
+from collections import Counter
+from copy import deepcopy
+from hashlib import sha1
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Favourite, ShoppingCart, Subscription
+from recipes.shopping_lists import get_shopping_list_version
+
+RECIPE_DATA_VERSION_KEY = 'recipe_data_version'
+RECIPE_CACHE_EVENTS = ('hits', 'misses')
+USER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+# Попадания считаются в каждом процессе отдельно, как у token_cache:
+# общий кэш не гарантирует атомарного инкремента (FileBasedCache),
+# а запись в него на каждый запрос дороже самого счётчика.
+recipe_cache_stats = Counter()
+
+
+def bump_recipe_data_version(**kwargs):
+    cache.set(RECIPE_DATA_VERSION_KEY, uuid4().hex, None)
+
+
+def get_recipe_data_version():
+    return cache.get_or_set(RECIPE_DATA_VERSION_KEY, uuid4().hex, None)
+
+
+def get_recipe_cache_key(request):
+    version = get_recipe_data_version()
+    query = sorted(request.query_params.lists())
+    return 'recipes:' + sha1(
+        f'{version}:{request.get_host()}:{request.path}:{query}'.encode()
+    ).hexdigest()
+
+
+def get_recipe_cache_stats():
+    return {event: recipe_cache_stats[event] for event in RECIPE_CACHE_EVENTS}
+
+
+def get_page_recipes(data):
+    return data['results'] if 'results' in data else [data]
+
+
+def set_user_flags(data, favorites=(), shopping_cart=(), subscriptions=()):
+    for recipe in get_page_recipes(data):
+        recipe['is_favorited'] = recipe['id'] in favorites
+        recipe['is_in_shopping_cart'] = recipe['id'] in shopping_cart
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in subscriptions
+        )
+    return data
+
+
+def overlay_user_flags(data, user):
+    recipes = get_page_recipes(data)
+    recipe_ids = [recipe['id'] for recipe in recipes]
+    return set_user_flags(
+        data,
+        favorites=set(Favourite.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True)),
+        shopping_cart=set(ShoppingCart.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True)),
+        subscriptions=set(Subscription.objects.filter(
+            subscriber=user,
+            author_id__in={recipe['author']['id'] for recipe in recipes}
+        ).values_list('author_id', flat=True))
+    )
+
+
+def get_cached_recipe_data(request, get_response):
+    """Возвращает данные рецептов из общего кэша.
+
+    В кэше хранится ответ без пользовательских флагов; для авторизованных
+    пользователей флаги накладываются поверх него отдельными запросами.
+    Запросы с фильтрами по избранному и корзине не кэшируются.
+    """
+    user = request.user
+    if user.is_authenticated and any(
+        request.query_params.get(name) for name in USER_FILTERS
+    ):
+        return get_response().data
+    key = get_recipe_cache_key(request)
+    data = cache.get(key)
+    if data is None:
+        recipe_cache_stats['misses'] += 1
+        data = get_response().data
+        cache.set(
+            key,
+            set_user_flags(deepcopy(data)) if user.is_authenticated else data,
+            settings.RECIPES_CACHE_TIMEOUT
+        )
+        return data
+    recipe_cache_stats['hits'] += 1
+    if user.is_authenticated:
+        return overlay_user_flags(data, user)
+    return data
+
+
+def get_shopping_list_cache_key(user, file_format, date):
+    """Ключ меняется при изменении корзины, рецептов или продуктов."""
+    return 'shopping_list:' + sha1(
+        f'{get_shopping_list_version(user.id)}:{get_recipe_data_version()}:'
+        f'{user.id}:{file_format}:{date}'.encode()
+    ).hexdigest()
+
+
+def cache_streaming_content(key, chunks):
+    """Отдаёт части файла по мере готовности и кэширует файл целиком."""
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    cache.set(key, b''.join(content), settings.RECIPES_CACHE_TIMEOUT)
@@ -0,0 +1,44 @@
+from hashlib import sha1
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+
+from recipes.indexes import ProcessLocalIndex
+from .serializers import IngredientSerializer, TagSerializer
+
+
+class CatalogueSnapshot(ProcessLocalIndex):
+    """Заранее отрендеренный JSON справочника с ETag и Last-Modified.
+
+    Last-Modified - время версии данных, одинаковое во всех процессах.
+    """
+
+    def __init__(self, serializer_class, version_key):
+        super().__init__()
+        self.serializer_class = serializer_class
+        self.version_key = version_key
+
+    def build(self):
+        content = JSONRenderer().render(self.serializer_class(
+            self.serializer_class.Meta.model.objects.all(), many=True
+        ).data)
+        return content, f'"{sha1(content).hexdigest()}"'
+
+    def get_response(self, request):
+        (content, etag), (last_modified, _) = self.get_versioned_index()
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+tags_snapshot = CatalogueSnapshot(TagSerializer, 'tags_snapshot_version')
+ingredients_snapshot = CatalogueSnapshot(
+    IngredientSerializer, 'ingredients_snapshot_version'
+)
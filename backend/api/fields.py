@@ -0,0 +1,115 @@
+import binascii
+import uuid
+from tempfile import SpooledTemporaryFile
+
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
+from rest_framework import serializers
+
+from recipes.constants import (
+    BASE64_CHUNK_SIZE, IMAGE_FULL_DECODE_MAX_PIXELS, IMAGE_MAX_DIMENSION,
+    IMAGE_MAX_PIXELS, IMAGE_UPLOAD_MAX_SIZE, IMAGE_UPLOAD_SPOOL_SIZE
+)
+
+IMAGE_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'GIF': ('gif', 'image/gif'),
+    'WEBP': ('webp', 'image/webp'),
+}
+
+
+class StreamingBase64ImageField(serializers.FileField):
+    """Изображение в base64 с ограниченным расходом памяти.
+
+    Строка декодируется частями во временный файл, который остаётся в
+    памяти только до IMAGE_UPLOAD_SPOOL_SIZE. Размеры изображения
+    проверяются по заголовку до полного декодирования. Слишком большие
+    изображения уменьшаются до IMAGE_MAX_DIMENSION: JPEG - уже при
+    декодировании, остальные форматы декодируются целиком, поэтому
+    для них число пикселей ограничено строже. Изображение декодируется
+    полностью, так что повреждённые файлы отклоняются.
+    """
+
+    default_error_messages = {
+        'invalid_image': 'Загрузите корректное изображение в base64.',
+        'too_large': 'Размер файла не должен превышать {max_size} байт.',
+        'too_many_pixels': 'Изображение не должно превышать '
+                           '{max_pixels} пикселей.',
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or not data:
+            self.fail('invalid_image')
+        file = self.decode(data)
+        try:
+            image = Image.open(file)
+        except Image.DecompressionBombError:
+            self.fail('too_many_pixels', max_pixels=IMAGE_MAX_PIXELS)
+        except OSError:
+            self.fail('invalid_image')
+        if image.format not in IMAGE_FORMATS:
+            self.fail('invalid_image')
+        width, height = image.size
+        if width * height > IMAGE_MAX_PIXELS:
+            self.fail('too_many_pixels', max_pixels=IMAGE_MAX_PIXELS)
+        extension, content_type = IMAGE_FORMATS[image.format]
+        try:
+            if max(width, height) > IMAGE_MAX_DIMENSION:
+                if (
+                    image.format != 'JPEG'
+                    and width * height > IMAGE_FULL_DECODE_MAX_PIXELS
+                ):
+                    self.fail(
+                        'too_many_pixels',
+                        max_pixels=IMAGE_FULL_DECODE_MAX_PIXELS
+                    )
+                file = self.downscale(image)
+            else:
+                image.load()
+        except OSError:
+            self.fail('invalid_image')
+        file.seek(0, 2)
+        size = file.tell()
+        file.seek(0)
+        return super().to_internal_value(UploadedFile(
+            file=file,
+            name=f'{uuid.uuid4()}.{extension}',
+            content_type=content_type,
+            size=size
+        ))
+
+    def decode(self, data):
+        start = data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        if (len(data) - start) * 3 // 4 > IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('too_large', max_size=IMAGE_UPLOAD_MAX_SIZE)
+        file = SpooledTemporaryFile(max_size=IMAGE_UPLOAD_SPOOL_SIZE)
+        tail = ''
+        try:
+            for position in range(start, len(data), BASE64_CHUNK_SIZE):
+                # Переводы строк (base64 по 76 символов) не входят
+                # в группы по 4 символа.
+                chunk = tail + ''.join(
+                    data[position:position + BASE64_CHUNK_SIZE].split()
+                )
+                aligned = len(chunk) - len(chunk) % 4
+                tail = chunk[aligned:]
+                file.write(binascii.a2b_base64(chunk[:aligned]))
+            if tail:
+                file.write(binascii.a2b_base64(tail))
+        except binascii.Error:
+            self.fail('invalid_image')
+        file.seek(0)
+        return file
+
+    def downscale(self, image):
+        # draft() декодирует JPEG сразу в уменьшенном в 2-8 раз виде,
+        # для остальных форматов ничего не делает.
+        size = (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION)
+        image_format = image.format
+        image.draft(image.mode, size)
+        image.thumbnail(size)
+        file = SpooledTemporaryFile(max_size=IMAGE_UPLOAD_SPOOL_SIZE)
+        image.save(file, image_format)
+        return file
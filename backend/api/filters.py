@@ -1,5 +1,6 @@
 from django_filters import rest_framework as filter
-from recipes.models import Ingredient, Recipe
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
 
 
 class IngredientsFilter(filter.FilterSet):
@@ -19,8 +20,10 @@ class RecipeFilter(filter.FilterSet):
         field_name='author__id',
         lookup_expr='exact'
     )
-    tags = filter.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    tags = filter.ModelMultipleChoiceFilter(
+        field_name='tags__slug',
+        to_field_name='slug',
+        queryset=Tag.objects.all()
     )
     is_favorited = filter.BooleanFilter(
         method='get_is_favorited'
@@ -28,21 +31,27 @@ class RecipeFilter(filter.FilterSet):
     is_in_shopping_cart = filter.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filter.CharFilter(
+        method='get_search'
+    )
 
     def get_is_favorited(self, recipes, name, value):
         if value:
-            return recipes.filter(
-                favourites__user_id=self.request.user.id
-            )
+            return recipes.filter(is_favorited=True)
         return recipes
 
     def get_is_in_shopping_cart(self, recipes, name, value):
         if value:
-            return recipes.filter(
-                shoppingcarts__user_id=self.request.user.id
-            )
+            return recipes.filter(is_in_shopping_cart=True)
+        return recipes
+
+    def get_search(self, recipes, name, value):
+        if value:
+            return search_recipes(recipes, value)
         return recipes
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'tags', 'is_favorited', 'is_in_shopping_cart', 'search'
+        )
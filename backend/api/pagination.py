@@ -1,6 +1,46 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class LimitCursorPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    page_size = PageLimitPagination.page_size
+    ordering = ('-pub_date', '-id')
+
+
+class UserLimitCursorPagination(LimitCursorPagination):
+    ordering = ('username',)
+
+
+class FeedCursorPagination(LimitCursorPagination):
+    ordering = ('-pub_date', '-recipe_id')
+
+
+class PageOrCursorPagination(PageLimitPagination):
+    """Постраничная пагинация, переключаемая на курсорную по ?cursor=."""
+
+    cursor_pagination_class = LimitCursorPagination
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class UserPageOrCursorPagination(PageOrCursorPagination):
+    cursor_pagination_class = UserLimitCursorPagination
@@ -1,53 +1,81 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
 from recipes.constants import (
-    MAX_RECIPE_NAME_LENGTH, MIN_COOKING_TIME, MIN_AMOUNT
+    MAX_BULK_RECIPES, MAX_RECIPE_NAME_LENGTH, MIN_COOKING_TIME, MIN_AMOUNT
 )
+from recipes.images import get_variant_urls
 from recipes.models import (
     Favourite, FoodgramUser, Ingredient, Recipe,
     RecipeIngredient, ShoppingCart, Subscription, Tag
 )
+from recipes.signals import recipe_ingredients_changed
+from .fields import StreamingBase64ImageField
 from .validators import validate_ingredients_or_tags
 from .utils import (
+    get_recipes_limit,
     get_serializer_method_field_value,
-    create_ingredients_in_recipe
+    create_ingredients_in_recipe,
+    update_ingredients_in_recipe,
+    update_tags_in_recipe
 )
 
 
-class NeverEmptyBase64ImageField(Base64ImageField):
-    EMPTY_VALUES = ()
-
-
 class FoodgramUserReadSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = FoodgramUser
-        fields = (*UserSerializer.Meta.fields, 'avatar', 'is_subscribed')
+        fields = (
+            *UserSerializer.Meta.fields, 'avatar', 'avatar_variants',
+            'is_subscribed'
+        )
+
+    def get_avatar_variants(self, user):
+        return get_variant_urls(
+            user.avatar, user.avatar_variants_source,
+            self.context.get('request')
+        )
 
     def get_is_subscribed(self, author):
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         return get_serializer_method_field_value(
             self.context, Subscription, author, 'subscriber', 'author'
         )
 
 
 class AvatarSerializer(serializers.Serializer):
-    avatar = NeverEmptyBase64ImageField()
+    avatar = StreamingBase64ImageField()
 
 
 class RecipeBriefSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, recipe):
+        return get_variant_urls(
+            recipe.image, recipe.image_variants_source,
+            self.context.get('request')
+        )
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False,
+        max_length=MAX_BULK_RECIPES
+    )
 
 
 class SubscriptionReadSerializer(FoodgramUserReadSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        read_only=True, source='recipes.count')
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = FoodgramUser
@@ -55,31 +83,27 @@ class SubscriptionReadSerializer(FoodgramUserReadSerializer):
             *FoodgramUserReadSerializer.Meta.fields, 'recipes', 'recipes_count'
         )
 
-    def get_recipes(self, obj):
-        return RecipeBriefSerializer(
-            obj.recipes.all()[:int(
-                self.context.get(
-                    'request'
-                ).query_params.get(
-                    'recipes_limit',
-                    10**10
-                ))],
-            many=True
-        ).data
+    def get_recipes(self, author):
+        recipes = getattr(author, 'recent_recipes', None)
+        if recipes is None:
+            recipes = author.recipes.all()[
+                :get_recipes_limit(self.context['request'])
+            ]
+        return RecipeBriefSerializer(recipes, many=True).data
 
 
 class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'slug')
 
 
 class IngredientSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
 
 
 class RecipeIngredientsReadSerializer(serializers.ModelSerializer):
@@ -117,31 +141,42 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         many=True, source='recipeingredients')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        exclude = ('pub_date',)
+        exclude = ('pub_date', 'updated_at', 'favorites_count')
         read_only_fields = ('id', 'tags', 'author', 'ingredients',
                             'is_favorited', 'is_in_shopping_cart',
-                            'name', 'image', 'text', 'cooking_time'
+                            'name', 'image', 'image_variants', 'text',
+                            'cooking_time'
                             )
 
+    def get_image_variants(self, recipe):
+        return get_variant_urls(
+            recipe.image, recipe.image_variants_source,
+            self.context.get('request')
+        )
+
     def get_is_favorited(self, recipe):
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
         return get_serializer_method_field_value(
             self.context, Favourite, recipe, 'user_id', 'recipe'
         )
 
     def get_is_in_shopping_cart(self, recipe):
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
         return get_serializer_method_field_value(
             self.context, ShoppingCart, recipe, 'user_id', 'recipe'
         )
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all())
+    tags = serializers.ListField(child=serializers.IntegerField())
     author = serializers.PrimaryKeyRelatedField(read_only=True)
-    image = NeverEmptyBase64ImageField()
+    image = StreamingBase64ImageField()
     ingredients = RecipeIngredientWriteSerializer(many=True)
     name = serializers.CharField(max_length=MAX_RECIPE_NAME_LENGTH)
     cooking_time = serializers.IntegerField(
@@ -159,14 +194,22 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         )
 
     def validate_ingredients(self, ingredients):
-        all_id = [ingredient['id'] for ingredient in ingredients]
-        validate_ingredients_or_tags(all_id, Ingredient, 'ingredients')
-        return ingredients
+        all_ingredients = validate_ingredients_or_tags(
+            [ingredient['id'] for ingredient in ingredients],
+            Ingredient,
+            'ingredients'
+        )
+        return [
+            {
+                'ingredient': all_ingredients[ingredient['id']],
+                'amount': ingredient['amount']
+            }
+            for ingredient in ingredients
+        ]
 
     def validate_tags(self, tags):
-        all_id = [tag.id for tag in tags]
-        validate_ingredients_or_tags(all_id, Tag, 'tags')
-        return tags
+        all_tags = validate_ingredients_or_tags(tags, Tag, 'tags')
+        return [all_tags[id] for id in tags]
 
     def validate(self, data):
         if 'ingredients' not in data:
@@ -179,24 +222,42 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = super().create(validated_data)
         recipe.tags.set(tags)
         create_ingredients_in_recipe(recipe, ingredients)
+        recipe_ingredients_changed.send(sender=Recipe, recipe_id=recipe.id)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        create_ingredients_in_recipe(instance, ingredients)
-        return super().update(instance, validated_data)
+        self.changed_rows = {
+            'tags': update_tags_in_recipe(instance, tags),
+            'ingredients': update_ingredients_in_recipe(
+                instance, ingredients
+            )
+        }
+        if (
+            self.changed_rows['ingredients']['created']
+            or self.changed_rows['ingredients']['deleted']
+        ):
+            recipe_ingredients_changed.send(
+                sender=Recipe, recipe_id=instance.id
+            )
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=(*validated_data, 'updated_at'))
+        return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance], 'tags', 'recipeingredients__ingredient'
+        )
         return RecipeReadSerializer(
             instance, context={'request': self.context['request']}
         ).data
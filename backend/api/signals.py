@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_save
+)
+from django.dispatch import receiver
+
+from recipes.images import variants_created
+from recipes.models import (
+    FoodgramUser, Ingredient, Recipe, RecipeIngredient, Tag
+)
+from recipes.signals import catalogue_imported, recipe_ingredients_changed
+from rest_framework.authtoken.models import Token
+from .authentication import token_cache
+from .cache import bump_recipe_data_version
+from .catalogues import ingredients_snapshot, tags_snapshot
+
+# Поля автора, которые входят в кэшированные данные рецептов.
+RECIPE_AUTHOR_FIELDS = (
+    'email', 'username', 'first_name', 'last_name', 'avatar',
+    'avatar_variants_source'
+)
+
+
+@receiver((post_save, post_delete, catalogue_imported), sender=Tag)
+def invalidate_tags_snapshot(**kwargs):
+    tags_snapshot.invalidate()
+
+
+@receiver((post_save, post_delete, catalogue_imported), sender=Ingredient)
+def invalidate_ingredients_snapshot(**kwargs):
+    ingredients_snapshot.invalidate()
+
+
+for model in (Recipe, RecipeIngredient, Tag, Ingredient):
+    post_save.connect(bump_recipe_data_version, sender=model)
+    post_delete.connect(bump_recipe_data_version, sender=model)
+for model in (Recipe, Tag, Ingredient):
+    catalogue_imported.connect(bump_recipe_data_version, sender=model)
+m2m_changed.connect(bump_recipe_data_version, sender=Recipe.tags.through)
+# Ключ кэша списков покупок тоже включает эту версию (см. apply_recipe_deltas).
+recipe_ingredients_changed.connect(bump_recipe_data_version, sender=Recipe)
+post_delete.connect(bump_recipe_data_version, sender=FoodgramUser)
+variants_created.connect(bump_recipe_data_version, sender=Recipe)
+
+
+@receiver(pre_save, sender=FoodgramUser)
+def remember_recipe_author_data(instance, update_fields, **kwargs):
+    fields = [
+        field for field in RECIPE_AUTHOR_FIELDS
+        if update_fields is None or field in update_fields
+    ]
+    instance.previous_author_data = None
+    if fields and not instance._state.adding:
+        instance.previous_author_data = FoodgramUser.objects.filter(
+            pk=instance.pk
+        ).values(*fields).first()
+
+
+@receiver(post_save, sender=FoodgramUser)
+def bump_recipe_data_version_on_user_change(instance, **kwargs):
+    previous = getattr(instance, 'previous_author_data', None)
+    if previous and any(
+        FoodgramUser._meta.get_field(field).value_to_string(instance) != value
+        for field, value in previous.items()
+    ):
+        bump_recipe_data_version()
+
+
+@receiver((post_delete, post_save), sender=FoodgramUser)
+def invalidate_user_tokens(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    invalidate_tokens(instance.id)
+
+
+@receiver(variants_created, sender=Recipe)
+def invalidate_variant_user_tokens(user_ids, **kwargs):
+    for user_id in user_ids:
+        invalidate_tokens(user_id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    invalidate_tokens(instance.user_id)
+
+
+def invalidate_tokens(user_id):
+    # После коммита, чтобы другие процессы не закэшировали старые данные.
+    transaction.on_commit(lambda: token_cache.invalidate(user_id))
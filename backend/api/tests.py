@@ -0,0 +1,644 @@
+import base64
+import json
+import os
+import shutil
+import subprocess
+import sys
+from datetime import timedelta
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile, mkdtemp
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APIRequestFactory
+
+from recipes.constants import IMAGE_MAX_DIMENSION, MAX_BULK_RECIPES
+from recipes.images import create_variants, get_variant_names
+from .authentication import token_cache
+from .cache import get_recipe_data_version
+from recipes.models import (
+    Favourite, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Subscription, Tag
+)
+from .fields import StreamingBase64ImageField
+from .serializers import RecipeWriteSerializer
+
+# Пиковый прирост памяти процесса (VmHWM, КБ) при разборе изображения.
+# tracemalloc не видит буферы Pillow, поэтому замер идёт в подпроцессе;
+# ru_maxrss не подходит: он наследует максимум родителя.
+PEAK_MEMORY_SCRIPT = '''
+import sys
+
+import django
+
+django.setup()
+
+from rest_framework.exceptions import ValidationError
+
+from api.fields import StreamingBase64ImageField
+
+
+def get_peak_rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+
+
+with open(sys.argv[1]) as file:
+    data = file.read()
+before = get_peak_rss()
+try:
+    StreamingBase64ImageField().to_internal_value(data)
+except ValidationError:
+    pass
+print(get_peak_rss() - before)
+'''
+# PNG больше IMAGE_FULL_DECODE_MAX_PIXELS отклоняется без декодирования,
+# JPEG декодируется в уменьшенном вдвое виде и затем уменьшается.
+MAX_PEAK_MEMORY_KB = {
+    'PNG': 16 * 1024,
+    'JPEG': 128 * 1024,
+}
+MEDIA_ROOT = mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+def create_image(size, image_format, mode='RGB'):
+    file = BytesIO()
+    Image.new(mode, size, 'orange').save(file, image_format)
+    return file.getvalue()
+
+
+def encode_image(size, image_format, mode='RGB'):
+    return base64.b64encode(create_image(size, image_format, mode)).decode()
+
+
+def save_recipe_image():
+    return default_storage.save(
+        'recipes/images/recipe.png',
+        ContentFile(create_image((40, 30), 'PNG'))
+    )
+
+
+class StreamingBase64ImageFieldTest(SimpleTestCase):
+
+    def test_line_wrapped_base64(self):
+        data = encode_image((40, 30), 'PNG')
+        wrapped = '\n'.join(
+            data[position:position + 76]
+            for position in range(0, len(data), 76)
+        )
+        image = Image.open(
+            StreamingBase64ImageField().to_internal_value(
+                f'data:image/png;base64,{wrapped}'
+            )
+        )
+        self.assertEqual(image.size, (40, 30))
+
+    def test_large_png_is_downscaled(self):
+        image = Image.open(StreamingBase64ImageField().to_internal_value(
+            encode_image((3000, 2000), 'PNG', 'L')
+        ))
+        self.assertEqual(image.format, 'PNG')
+        self.assertEqual(image.size, (IMAGE_MAX_DIMENSION, 1707))
+
+    def test_truncated_image_is_rejected(self):
+        for image_format in ('JPEG', 'PNG'):
+            with self.subTest(image_format=image_format):
+                data = create_image((400, 300), image_format)
+                with self.assertRaises(ValidationError):
+                    StreamingBase64ImageField().to_internal_value(
+                        base64.b64encode(data[:len(data) // 2]).decode()
+                    )
+
+    def test_large_jpeg_is_downscaled(self):
+        image = Image.open(StreamingBase64ImageField().to_internal_value(
+            encode_image((IMAGE_MAX_DIMENSION * 2, 100), 'JPEG')
+        ))
+        self.assertEqual(image.size, (IMAGE_MAX_DIMENSION, 50))
+
+    def get_peak_memory(self, data):
+        with NamedTemporaryFile('w', suffix='.txt') as file:
+            file.write(data)
+            file.flush()
+            return int(subprocess.run(
+                (sys.executable, '-c', PEAK_MEMORY_SCRIPT, file.name),
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                check=True,
+                text=True
+            ).stdout)
+
+    def test_peak_memory(self):
+        for image_format, max_peak_memory in MAX_PEAK_MEMORY_KB.items():
+            with self.subTest(image_format=image_format):
+                self.assertLess(
+                    self.get_peak_memory(
+                        encode_image((7000, 7000), image_format)
+                    ),
+                    max_peak_memory
+                )
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeListQueriesTest(TestCase):
+    """Число запросов на страницу списка не зависит от её размера."""
+
+    # Количество, рецепты, авторы, теги, продукты рецептов.
+    LIST_QUERIES = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            FoodgramUser.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for i in range(3)
+        ]
+        cls.user = cls.authors[0]
+        tags = [
+            Tag.objects.create(name=f'Тег {i}', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'продукт {i}',
+                                      measurement_unit='г')
+            for i in range(5)
+        ]
+        image = save_recipe_image()
+        for i in range(60):
+            recipe = Recipe.objects.create(
+                author=cls.authors[i % 3], name=f'Рецепт {i}',
+                image=image, text='Текст', cooking_time=10
+            )
+            recipe.tags.set(tags[:i % 3 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in ingredients[:i % 5 + 1]
+            )
+            if i % 2:
+                Favourite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(
+            subscriber=cls.user, author=cls.authors[1]
+        )
+        create_variants(image)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_list_queries(self, client):
+        for limit in (6, 50):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(self.LIST_QUERIES):
+                    response = client.get(
+                        '/api/recipes/', {'limit': limit}
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_list_queries(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_list_queries(client)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = FoodgramUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        token = APIClient().post(
+            '/api/auth/token/login/',
+            {'email': 'user@example.com', 'password': 'password'}
+        ).data['auth_token']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        for _ in range(2):
+            self.assertEqual(
+                self.client.get('/api/users/me/').status_code, 200
+            )
+        self.assertGreater(token_cache.get_stats()['hits'], 0)
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(
+                self.client.post('/api/auth/token/logout/').status_code, 204
+            )
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_other_user_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            FoodgramUser.objects.create_user(
+                email='other@example.com', username='other',
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+        hits = token_cache.get_stats()['hits']
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertEqual(token_cache.get_stats()['hits'], hits + 1)
+
+    @override_settings(MEDIA_ROOT=MEDIA_ROOT)
+    def test_cached_user_keeps_counters(self):
+        author = FoodgramUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.assertEqual(
+            self.client.post(f'/api/users/{author.id}/subscribe/').status_code,
+            201
+        )
+        self.assertEqual(
+            self.client.put(
+                '/api/users/me/avatar/',
+                {'avatar': encode_image((40, 30), 'PNG')},
+                format='json'
+            ).status_code,
+            200
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.subscriptions_count, 1)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeUpdateChangedRowsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = FoodgramUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {i}', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'продукт {i}',
+                                      measurement_unit='г')
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', image=save_recipe_image(),
+            text='Текст', cooking_time=10
+        )
+        self.recipe.tags.set(self.tags[:2])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=self.recipe, ingredient=ingredient, amount=10
+            )
+            for ingredient in self.ingredients[:3]
+        )
+
+    def update(self, tags, ingredients):
+        request = APIRequestFactory().patch('/')
+        request.user = self.user
+        serializer = RecipeWriteSerializer(
+            self.recipe,
+            data={
+                'name': 'Рецепт',
+                'text': 'Новый текст',
+                'cooking_time': 15,
+                'tags': [tag.id for tag in tags],
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ],
+            },
+            partial=True,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return serializer.changed_rows
+
+    def test_text_only(self):
+        unchanged = {'created': 0, 'updated': 0, 'deleted': 0}
+        self.assertEqual(
+            self.update(
+                self.tags[:2],
+                [(ingredient, 10) for ingredient in self.ingredients[:3]]
+            ),
+            {'tags': unchanged, 'ingredients': unchanged}
+        )
+
+    def test_mixed_edit(self):
+        self.assertEqual(
+            self.update(
+                self.tags[1:],
+                [
+                    (self.ingredients[0], 10),
+                    (self.ingredients[1], 20),
+                    (self.ingredients[3], 5),
+                ]
+            ),
+            {
+                'tags': {'created': 1, 'updated': 0, 'deleted': 1},
+                'ingredients': {'created': 1, 'updated': 1, 'deleted': 1},
+            }
+        )
+        self.assertEqual(
+            dict(self.recipe.recipeingredients.values_list(
+                'ingredient_id', 'amount'
+            )),
+            {
+                self.ingredients[0].id: 10,
+                self.ingredients[1].id: 20,
+                self.ingredients[3].id: 5,
+            }
+        )
+        self.assertEqual(
+            set(self.recipe.tags.all()), set(self.tags[1:])
+        )
+
+    def test_cached_shopping_list_follows_recipe_edit(self):
+        cache.clear()
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        def amounts():
+            shopping_list = json.loads(b''.join(client.get(
+                '/api/recipes/download_shopping_cart/', {'format': 'json'}
+            ).streaming_content))
+            return {product['amount'] for product in shopping_list['products']}
+
+        self.assertEqual(amounts(), {10})
+        self.update(
+            self.tags[:2],
+            [(ingredient, 25) for ingredient in self.ingredients[:3]]
+        )
+        self.assertEqual(amounts(), {25})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class CounterFieldsTest(TestCase):
+    """Сохранение устаревшего объекта не затирает счётчики."""
+
+    def setUp(self):
+        self.user, self.author = [
+            FoodgramUser.objects.create_user(
+                email=f'{username}@example.com', username=username,
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for username in ('user', 'author')
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_avatar_change_after_subscription(self):
+        self.assertEqual(
+            self.client.post(
+                f'/api/users/{self.author.id}/subscribe/'
+            ).status_code,
+            201
+        )
+        self.assertEqual(
+            self.client.put(
+                '/api/users/me/avatar/',
+                {'avatar': encode_image((40, 30), 'PNG')},
+                format='json'
+            ).status_code,
+            200
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.subscriptions_count, 1)
+
+    def test_recipe_edit_after_favourite(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image=save_recipe_image(),
+            text='Текст', cooking_time=10
+        )
+        Favourite.objects.create(user=self.user, recipe=recipe)
+        recipe.text = 'Новый текст'
+        recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.text, 'Новый текст')
+
+    def test_recipe_ingredient_change(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image=save_recipe_image(),
+            text='Текст', cooking_time=10
+        )
+        old, new = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('старый', 'новый')
+        ]
+        recipe_ingredient = RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=old, amount=10
+        )
+        recipe_ingredient.ingredient = new
+        recipe_ingredient.save()
+        self.assertEqual(
+            dict(Ingredient.objects.filter(
+                id__in=(old.id, new.id)
+            ).values_list('name', 'recipes_count')),
+            {'старый': 0, 'новый': 1}
+        )
+
+
+class RecipeDataVersionTest(TestCase):
+    """Версия данных рецептов меняется только вместе с данными автора."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = FoodgramUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+
+    def test_password_change_keeps_version(self):
+        version = get_recipe_data_version()
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertEqual(get_recipe_data_version(), version)
+
+    def test_name_change_bumps_version(self):
+        version = get_recipe_data_version()
+        self.user.first_name = 'Новое имя'
+        self.user.save()
+        self.assertNotEqual(get_recipe_data_version(), version)
+
+
+class BulkUserRecipesTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(FoodgramUser.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password'
+        ))
+
+    def test_invalid_id_lists_are_rejected(self):
+        for recipe_ids in ([], list(range(1, MAX_BULK_RECIPES + 2))):
+            for url in ('/api/recipes/favorite/',
+                        '/api/recipes/shopping_cart/'):
+                with self.subTest(url=url, count=len(recipe_ids)):
+                    response = self.client.post(
+                        url, {'recipes': recipe_ids}, format='json'
+                    )
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn('recipes', response.data)
+
+    def test_max_id_list_is_accepted(self):
+        response = self.client.delete(
+            '/api/recipes/favorite/',
+            {'recipes': list(range(1, MAX_BULK_RECIPES + 1))},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), MAX_BULK_RECIPES)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ImageVariantsTest(TestCase):
+
+    def setUp(self):
+        author = FoodgramUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', image=save_recipe_image(),
+            text='Текст', cooking_time=10
+        )
+        create_variants(self.recipe.image.name)
+        self.variant_names = get_variant_names(self.recipe.image.name)
+        for name in self.variant_names:
+            self.assertTrue(default_storage.exists(name))
+
+    def test_variant_urls_are_absolute(self):
+        response = APIClient().get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(
+            sorted(
+                url
+                for formats in response.data['image_variants'].values()
+                for url in formats.values()
+            ),
+            sorted(
+                'http://testserver' + default_storage.url(name)
+                for name in self.variant_names
+            )
+        )
+
+    def test_replaced_image_variants_are_deleted(self):
+        self.recipe.image = save_recipe_image()
+        with patch('recipes.signals.schedule_variants'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.recipe.save()
+        for name in self.variant_names:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_deleted_recipe_variants_are_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        for name in self.variant_names:
+            self.assertFalse(default_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ExportRecipesStateTest(TestCase):
+
+    def setUp(self):
+        author = FoodgramUser.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password'
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', image=save_recipe_image(),
+                text='Текст', cooking_time=10
+            )
+            for i in range(2)
+        ]
+        directory = mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.state = os.path.join(directory, 'state.json')
+        self.output = os.path.join(directory, 'recipes.jsonl')
+
+    def export(self):
+        call_command(
+            'export_recipes', state=self.state, output=self.output,
+            stderr=StringIO()
+        )
+        with open(self.output, encoding='utf-8') as file:
+            return [json.loads(line)['id'] for line in file]
+
+    def test_late_commit_is_exported_once(self):
+        self.assertEqual(
+            self.export(), [recipe.id for recipe in self.recipes]
+        )
+        self.assertEqual(self.export(), [])
+        # Рецепт сохранён до прошлой выгрузки, но закоммичен после неё.
+        with open(self.state, encoding='utf-8') as file:
+            last_run = parse_datetime(json.load(file)['last_run'])
+        Recipe.objects.filter(id=self.recipes[0].id).update(
+            updated_at=last_run - timedelta(seconds=1)
+        )
+        self.assertEqual(self.export(), [self.recipes[0].id])
+        self.assertEqual(self.export(), [])
+
+
+@skipUnless(
+    connection.vendor == 'sqlite',
+    'На PostgreSQL рассылка уходит в пул потоков вне транзакции теста'
+)
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class FeedFanOutTest(TestCase):
+
+    def test_new_recipe_reaches_subscribers(self):
+        author, *subscribers = [
+            FoodgramUser.objects.create_user(
+                email=f'user{i}@example.com', username=f'user{i}',
+                first_name='Имя', last_name='Фамилия', password='password'
+            )
+            for i in range(3)
+        ]
+        for subscriber in subscribers:
+            Subscription.objects.create(subscriber=subscriber, author=author)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт', image=save_recipe_image(),
+                text='Текст', cooking_time=10
+            )
+        client = APIClient()
+        for subscriber in subscribers:
+            client.force_authenticate(subscriber)
+            response = client.get('/api/recipes/feed/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [item['id'] for item in response.data['results']],
+                [recipe.id]
+            )
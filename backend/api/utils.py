@@ -1,6 +1,16 @@
-import datetime
+import csv
+import json
 
-from recipes.models import Ingredient, RecipeIngredient
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework import serializers
+
+from recipes.constants import DEFAULT_RECIPES_LIMIT, MAX_RECIPES_LIMIT
+from recipes.counters import change_counter
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.shopping_lists import apply_recipe_deltas
+from recipes.signals import user_recipes_added, user_recipes_removed
 
 
 def get_serializer_method_field_value(
@@ -15,38 +25,275 @@ def get_serializer_method_field_value(
     )
 
 
+def get_limit_param(request, param, default=None, maximum=None):
+    limit = request.query_params.get(param)
+    if limit is None:
+        return default
+    try:
+        limit = max(0, int(limit))
+    except ValueError:
+        raise serializers.ValidationError({param: 'Укажите целое число'})
+    return limit if maximum is None else min(limit, maximum)
+
+
+def get_ids_param(request, param):
+    """Список id из ?param=1,2&param=3."""
+    try:
+        return [
+            int(value)
+            for values in request.query_params.getlist(param)
+            for value in values.split(',')
+            if value
+        ]
+    except ValueError:
+        raise serializers.ValidationError(
+            {param: 'Укажите id через запятую'}
+        )
+
+
+def get_recipes_limit(request):
+    return get_limit_param(
+        request, 'recipes_limit', DEFAULT_RECIPES_LIMIT, MAX_RECIPES_LIMIT
+    )
+
+
+def attach_recent_recipes(authors, recipes_limit):
+    """Загружает последние рецепты авторов одним оконным запросом."""
+    authors = list(authors)
+    recent_recipes = {author.id: [] for author in authors}
+    if authors and recipes_limit:
+        ranked_sql, params = Recipe.objects.filter(
+            author_id__in=recent_recipes
+        ).annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()]
+            )
+        ).order_by().query.sql_with_params()
+        for recipe in Recipe.objects.raw(
+            f'SELECT * FROM ({ranked_sql}) ranked '
+            'WHERE row_number <= %s ORDER BY pub_date DESC, id DESC',
+            (*params, recipes_limit)
+        ):
+            recent_recipes[recipe.author_id].append(recipe)
+    for author in authors:
+        author.recent_recipes = recent_recipes[author.id]
+    return authors
+
+
+def supports_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    return (
+        connection.vendor == 'sqlite'
+        and connection.Database.sqlite_version_info >= (3, 35)
+    )
+
+
+def execute_returning(sql, rows, column):
+    """Выполняет sql для строк rows; возвращает значения column из
+    затронутых строк.
+
+    Без RETURNING строки обрабатываются по одной и затронутые
+    определяются по rowcount.
+    """
+    with connection.cursor() as cursor:
+        if supports_returning():
+            cursor.execute(
+                sql.format(', '.join(['(%s, %s)'] * len(rows)))
+                + f' RETURNING {column}',
+                [value for row in rows for value in row]
+            )
+            return {value for value, in cursor.fetchall()}
+        values = set()
+        for row in rows:
+            cursor.execute(sql.format('(%s, %s)'), row)
+            if cursor.rowcount:
+                values.add(row[1])
+        return values
+
+
+def get_user_recipe_sql(model):
+    quote = connection.ops.quote_name
+    return (
+        quote(model._meta.db_table),
+        quote(model._meta.get_field('user').column),
+        quote(model._meta.get_field('recipe').column)
+    )
+
+
+@transaction.atomic
+def add_user_recipes(model, user, recipe_ids):
+    """Добавляет рецепты одним INSERT ... ON CONFLICT DO NOTHING.
+
+    Возвращает множество id рецептов, которых у пользователя ещё не было.
+    Добавленные строки определяются самим INSERT, поэтому при
+    одновременных запросах каждая строка засчитывается один раз.
+    """
+    if not recipe_ids:
+        return set()
+    table, user_column, recipe_column = get_user_recipe_sql(model)
+    new_ids = execute_returning(
+        f'INSERT INTO {table} ({user_column}, {recipe_column}) VALUES {{}} '
+        f'ON CONFLICT ({user_column}, {recipe_column}) DO NOTHING',
+        [(user.id, id) for id in recipe_ids],
+        recipe_column
+    )
+    if new_ids:
+        user_recipes_added.send(
+            sender=model, user_id=user.id, recipe_ids=new_ids
+        )
+    return new_ids
+
+
+@transaction.atomic
+def remove_user_recipes(model, user, recipe_ids):
+    """Удаляет рецепты пользователя одним DELETE без сигналов по строкам.
+
+    Возвращает множество id рецептов, которые действительно были удалены.
+    """
+    if not recipe_ids:
+        return set()
+    table, user_column, recipe_column = get_user_recipe_sql(model)
+    deleted_ids = execute_returning(
+        f'DELETE FROM {table} '
+        f'WHERE ({user_column}, {recipe_column}) IN (VALUES {{}})',
+        [(user.id, id) for id in recipe_ids],
+        recipe_column
+    )
+    if deleted_ids:
+        user_recipes_removed.send(
+            sender=model, user_id=user.id, recipe_ids=deleted_ids
+        )
+    return deleted_ids
+
+
 def create_ingredients_in_recipe(recipe, ingredients):
-    ingredients_list = [
+    RecipeIngredient.objects.bulk_create(
         RecipeIngredient(
             recipe=recipe,
-            ingredient=Ingredient.objects.get(id=ingredient.pop('id')),
-            amount=ingredient.pop('amount')
+            ingredient=ingredient['ingredient'],
+            amount=ingredient['amount']
         ) for ingredient in ingredients
-    ]
-    RecipeIngredient.objects.bulk_create(
-        ingredients_list, ignore_conflicts=True
+    )
+    change_counter(
+        Ingredient,
+        [ingredient['ingredient'].id for ingredient in ingredients],
+        'recipes_count',
+        1
     )
 
 
-def generate_shopping_list(products, recipes):
-    product_string = ('{i}.{name} в количестве {ingredient_sum}'
-                      '{ingredient__measurement_unit}.')
-    recipe_string = '- {recipe__name}'
-    products_in_shopcart = [
-        product_string.format(
-            i=i, name=product.pop('ingredient__name').capitalize(), **product
+def update_tags_in_recipe(recipe, tags):
+    current_ids = set(recipe.tags.values_list('id', flat=True))
+    new_ids = {tag.id for tag in tags}
+    recipe.tags.remove(*current_ids - new_ids)
+    recipe.tags.add(*new_ids - current_ids)
+    return {
+        'created': len(new_ids - current_ids),
+        'updated': 0,
+        'deleted': len(current_ids - new_ids)
+    }
+
+
+def update_ingredients_in_recipe(recipe, ingredients):
+    current = {
+        recipe_ingredient.ingredient_id: recipe_ingredient
+        for recipe_ingredient in RecipeIngredient.objects.filter(
+            recipe=recipe
         )
-        for i, product in enumerate(products, start=1)
+    }
+    new_amounts = {
+        ingredient['ingredient'].id: ingredient['amount']
+        for ingredient in ingredients
+    }
+    deltas = {
+        id: amount - (current[id].amount if id in current else 0)
+        for id, amount in new_amounts.items()
+    }
+    deltas.update({
+        id: -recipe_ingredient.amount
+        for id, recipe_ingredient in current.items() if id not in new_amounts
+    })
+    to_create = [
+        ingredient for ingredient in ingredients
+        if ingredient['ingredient'].id not in current
     ]
-    recipes_in_shopcart = [
-        recipe_string.format(**recipe) for recipe in recipes
+    to_update = []
+    for id, recipe_ingredient in current.items():
+        if id in new_amounts and deltas[id]:
+            recipe_ingredient.amount = new_amounts[id]
+            to_update.append(recipe_ingredient)
+    to_delete = [
+        recipe_ingredient.id
+        for id, recipe_ingredient in current.items() if id not in new_amounts
     ]
-    return '\n'.join(
-        [
-            f'Список покупок от {datetime.date.today().isoformat()}:',
-            'Продукты:',
-            *products_in_shopcart,
-            'Для рецептов:',
-            *recipes_in_shopcart
-        ]
-    )
+    create_ingredients_in_recipe(recipe, to_create)
+    RecipeIngredient.objects.bulk_update(to_update, ('amount',))
+    if to_delete:
+        RecipeIngredient.objects.filter(id__in=to_delete).delete()
+    apply_recipe_deltas(recipe.id, deltas)
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'deleted': len(to_delete)
+    }
+
+
+class Echo:
+    """Буфер для csv.writer, который возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def generate_shopping_list(products, recipes, date):
+    product_string = ('{i}.{name} в количестве {ingredient_sum}'
+                      '{ingredient__measurement_unit}.\n')
+    yield f'Список покупок от {date}:\n'
+    yield 'Продукты:\n'
+    for i, product in enumerate(products, start=1):
+        yield product_string.format(
+            i=i, name=product.pop('ingredient__name').capitalize(), **product
+        )
+    yield 'Для рецептов:\n'
+    for recipe in recipes:
+        yield f'- {recipe["recipe__name"]}\n'
+
+
+def generate_shopping_list_csv(products, recipes, date):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Продукт', 'Количество', 'Единица измерения'))
+    for product in products:
+        yield writer.writerow((
+            product['ingredient__name'],
+            product['ingredient_sum'],
+            product['ingredient__measurement_unit']
+        ))
+
+
+def generate_shopping_list_json(products, recipes, date):
+    yield f'{{"date": "{date}", "products": ['
+    for i, product in enumerate(products):
+        yield ', ' * bool(i) + json.dumps(
+            {
+                'name': product['ingredient__name'],
+                'amount': product['ingredient_sum'],
+                'measurement_unit': product['ingredient__measurement_unit']
+            },
+            ensure_ascii=False
+        )
+    yield '], "recipes": ['
+    for i, recipe in enumerate(recipes):
+        yield ', ' * bool(i) + json.dumps(
+            recipe['recipe__name'], ensure_ascii=False
+        )
+    yield ']}'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (generate_shopping_list, 'text/plain'),
+    'csv': (generate_shopping_list_csv, 'text/csv'),
+    'json': (generate_shopping_list_json, 'application/json'),
+}
@@ -1,37 +1,67 @@
+import datetime
 from http import HTTPStatus
 
-from django.db.models import Sum
-from django.http import FileResponse
+from django.core.cache import cache
+from django.db.models import (
+    BooleanField, Exists, F, OuterRef, Prefetch, Value
+)
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
+from recipes.feeds import get_timeline
+from recipes.constants import INGREDIENT_FUZZY_LIMIT
+from recipes.indexes import (
+    ingredient_prefix_index, ingredient_trigram_index, recipe_id_index,
+    recipe_ingredient_index
+)
 from recipes.models import (
-    Favourite, FoodgramUser, Ingredient, Recipe,
-    RecipeIngredient, ShoppingCart, Subscription, Tag
+    Favourite, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    RecipeNeighbour, ShoppingCart, ShoppingListItem, Subscription, Tag
 )
+from recipes.short_links import encode_recipe_id
 from rest_framework import permissions, serializers, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import (
-    AllowAny, IsAuthenticated,
+    AllowAny, IsAdminUser, IsAuthenticated,
     IsAuthenticatedOrReadOnly
 )
 from rest_framework.response import Response
 
+from .authentication import token_cache
+from .cache import (
+    bump_recipe_data_version, cache_streaming_content,
+    get_cached_recipe_data, get_recipe_cache_stats,
+    get_shopping_list_cache_key
+)
+from .catalogues import ingredients_snapshot, tags_snapshot
 from .filters import IngredientsFilter, RecipeFilter
-from .pagination import PageLimitPagination
+from .pagination import (
+    FeedCursorPagination, PageLimitPagination, PageOrCursorPagination,
+    UserPageOrCursorPagination
+)
 from .permissions import IsAuthorOrReadOnly
 from .serializers import (
     AvatarSerializer, IngredientSerializer,
-    RecipeBriefSerializer, RecipeReadSerializer,
+    RecipeBriefSerializer, RecipeIdsSerializer, RecipeReadSerializer,
     RecipeWriteSerializer, SubscriptionReadSerializer,
     TagSerializer
 )
-from .utils import generate_shopping_list
+from .utils import (
+    SHOPPING_LIST_FORMATS, add_user_recipes, attach_recent_recipes,
+    get_ids_param, get_limit_param, get_recipes_limit, remove_user_recipes
+)
 
 
 class FoodgramUserViewSet(UserViewSet):
     queryset = FoodgramUser.objects.all()
-    pagination_class = PageLimitPagination
+    pagination_class = UserPageOrCursorPagination
+
+    def get_subscription_authors(self):
+        return FoodgramUser.objects.annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
 
     def get_permissions(self):
         if self.action == 'me':
@@ -51,9 +81,10 @@ class FoodgramUserViewSet(UserViewSet):
             avatar = serializer.validated_data['avatar']
             user = request.user
             user.avatar = avatar
-            user.save()
+            user.save(update_fields=('avatar',))
             return Response({'avatar': user.avatar.url}, status=HTTPStatus.OK)
-        request.user.avatar.delete()
+        request.user.avatar.delete(save=False)
+        request.user.save(update_fields=('avatar',))
         return Response(status=HTTPStatus.NO_CONTENT)
 
     @action(
@@ -66,6 +97,7 @@ class FoodgramUserViewSet(UserViewSet):
         subscriber = request.user
         author = get_object_or_404(FoodgramUser, id=id)
         if request.method == 'POST':
+            recipes_limit = get_recipes_limit(request)
             if subscriber == author:
                 raise serializers.ValidationError(
                     'Нельзя подписаться на себя самого'
@@ -78,6 +110,10 @@ class FoodgramUserViewSet(UserViewSet):
                 raise serializers.ValidationError(
                     'Вы уже подписаны на этого пользователя'
                 )
+            author, = attach_recent_recipes(
+                self.get_subscription_authors().filter(id=author.id),
+                recipes_limit
+            )
             return Response(
                 SubscriptionReadSerializer(
                     author,
@@ -97,11 +133,17 @@ class FoodgramUserViewSet(UserViewSet):
         permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
+        recipes_limit = get_recipes_limit(request)
         return self.get_paginated_response(
             SubscriptionReadSerializer(
-                self.paginate_queryset(FoodgramUser.objects.filter(
-                    authors__subscriber=request.user
-                )),
+                attach_recent_recipes(
+                    self.paginate_queryset(
+                        self.get_subscription_authors().filter(
+                            authors__subscriber=request.user
+                        )
+                    ),
+                    recipes_limit
+                ),
                 context={'request': request},
                 many=True
             ).data
@@ -114,6 +156,9 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return tags_snapshot.get_response(request)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -123,16 +168,87 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientsFilter
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return ingredients_snapshot.get_response(request)
+        if request.query_params.get('fuzzy') in ('1', 'true'):
+            return Response(ingredient_trigram_index.search(
+                name,
+                get_limit_param(request, 'limit', INGREDIENT_FUZZY_LIMIT)
+            ))
+        return Response(ingredient_prefix_index.search(
+            name, get_limit_param(request, 'limit')
+        ))
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly)
-    pagination_class = PageLimitPagination
+    pagination_class = PageOrCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_authenticated:
+            flags = dict(
+                is_favorited=Exists(Favourite.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )),
+            )
+            authors = FoodgramUser.objects.annotate(
+                is_subscribed=Exists(Subscription.objects.filter(
+                    subscriber=user, author=OuterRef('pk')
+                ))
+            )
+        else:
+            flags = dict(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+            authors = FoodgramUser.objects.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return Recipe.objects.annotate(**flags).prefetch_related(
+            Prefetch('author', queryset=authors),
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+
+    def list(self, request, *args, **kwargs):
+        return Response(get_cached_recipe_data(
+            request, lambda: super(RecipeViewSet, self).list(
+                request, *args, **kwargs
+            )
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_cached_recipe_data(
+            request, lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        ))
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        bump_recipe_data_version()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        bump_recipe_data_version()
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= у списка покупок выбирает формат файла, а не рендерер.
+        return super().perform_content_negotiation(
+            request, force=force or self.action == 'download_shopping_cart'
+        )
 
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
@@ -142,10 +258,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @staticmethod
     def create_or_delete(request, id, model):
         if request.method == 'POST':
-            user = request.user
             recipe = get_object_or_404(Recipe, id=id)
-            _, created = model.objects.get_or_create(user=user, recipe=recipe)
-            if not created:
+            if not add_user_recipes(model, request.user, (recipe.id,)):
                 raise serializers.ValidationError(
                     'Вы уже добавили этот рецепт'
                 )
@@ -153,9 +267,36 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 RecipeBriefSerializer(recipe).data,
                 status=HTTPStatus.CREATED
             )
-        get_object_or_404(model, user=request.user, recipe_id=id).delete()
+        if not remove_user_recipes(model, request.user, (int(id),)):
+            raise Http404
         return Response(status=HTTPStatus.NO_CONTENT)
 
+    @staticmethod
+    def bulk_create_or_delete(request, model):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            found_ids = set(Recipe.objects.filter(
+                id__in=recipe_ids
+            ).values_list('id', flat=True))
+            created_ids = add_user_recipes(model, request.user, found_ids)
+            statuses = {
+                id: 'created' if id in created_ids else 'exists'
+                for id in found_ids
+            }
+        else:
+            deleted_ids = remove_user_recipes(
+                model, request.user, set(recipe_ids)
+            )
+            statuses = {id: 'deleted' for id in deleted_ids}
+        return Response({
+            'results': [
+                {'id': id, 'status': statuses.get(id, 'not_found')}
+                for id in dict.fromkeys(recipe_ids)
+            ]
+        })
+
     @action(
         detail=False,
         methods=('POST', 'DELETE'),
@@ -167,6 +308,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
             request, id, Favourite
         )
 
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='favorite',
+        permission_classes=(IsAuthenticated,)
+    )
+    def manage_favorites(self, request):
+        return self.bulk_create_or_delete(request, Favourite)
+
     @action(
         detail=False,
         methods=('POST', 'DELETE'),
@@ -178,31 +328,129 @@ class RecipeViewSet(viewsets.ModelViewSet):
             request, id, ShoppingCart
         )
 
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        url_path='shopping_cart',
+        permission_classes=(IsAuthenticated,)
+    )
+    def manage_shopping_carts(self, request):
+        return self.bulk_create_or_delete(request, ShoppingCart)
+
     @action(
         detail=False,
         permission_classes=(IsAuthenticated,)
     )
     def download_shopping_cart(self, request):
-        ingredients_in_shopcart = RecipeIngredient.objects.filter(
-            recipe__shoppingcarts__user_id=request.user.id
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            ingredient_sum=Sum('amount')
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_LIST_FORMATS:
+            raise serializers.ValidationError({
+                'format': 'Доступные форматы: {}'.format(
+                    ', '.join(SHOPPING_LIST_FORMATS)
+                )
+            })
+        generate, content_type = SHOPPING_LIST_FORMATS[file_format]
+        date = datetime.date.today().isoformat()
+        key = get_shopping_list_cache_key(request.user, file_format, date)
+        etag = f'"{key.split(":")[-1]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            content = cache.get(key)
+            if content is None:
+                content = cache_streaming_content(key, (
+                    chunk.encode() for chunk in generate(
+                        ShoppingListItem.objects.filter(
+                            user=request.user
+                        ).values(
+                            'ingredient__name', 'ingredient__measurement_unit',
+                            ingredient_sum=F('total')
+                        ).order_by('ingredient__name').iterator(),
+                        ShoppingCart.objects.filter(
+                            user=request.user
+                        ).values('recipe__name').iterator(),
+                        date
+                    )
+                ))
+            else:
+                content = (content,)
+            response = StreamingHttpResponse(
+                content, content_type=content_type
+            )
+            response['Content-Disposition'] = (
+                f'attachment; filename="shopping_list.{file_format}"'
+            )
+        response['ETag'] = etag
+        return response
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedCursorPagination
+    )
+    def feed(self, request):
+        entries = self.paginate_queryset(get_timeline(request.user))
+        recipe_ids = [entry.recipe_id for entry in entries]
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        return self.get_paginated_response(self.get_serializer(
+            [recipes[id] for id in recipe_ids if id in recipes], many=True
+        ).data)
+
+    @action(
+        detail=False,
+        url_path='can-cook',
+        permission_classes=(AllowAny,),
+        pagination_class=PageLimitPagination
+    )
+    def can_cook(self, request):
+        ingredient_ids = get_ids_param(request, 'ingredients')
+        if not ingredient_ids:
+            raise serializers.ValidationError(
+                {'ingredients': 'Укажите имеющиеся продукты'}
+            )
+        page = self.paginate_queryset(
+            recipe_ingredient_index.rank(ingredient_ids)
         )
-        recipes_in_shopcart = ShoppingCart.objects.filter(
-            user=request.user
-        ).values(
-            'recipe__name'
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _ in page]
         )
-        return FileResponse(
-            generate_shopping_list(
-                ingredients_in_shopcart,
-                recipes_in_shopcart
-            ),
-            as_attachment=True,
-            filename='shopping_list.txt',
-            content_type='text/plain'
+        data = self.get_serializer(
+            [
+                recipes[recipe_id]
+                for recipe_id, _ in page if recipe_id in recipes
+            ],
+            many=True
+        ).data
+        missing = dict(page)
+        for recipe in data:
+            recipe['missing_ingredients'] = missing[recipe['id']]
+        return self.get_paginated_response(data)
+
+    @action(detail=True, permission_classes=(AllowAny,))
+    def similar(self, request, pk):
+        if not pk.isdigit() or not recipe_id_index.exists(int(pk)):
+            raise Http404(f'Рецепта не существует, id = {pk}')
+        return Response(RecipeBriefSerializer(
+            [
+                neighbour.neighbour
+                for neighbour in RecipeNeighbour.objects.filter(
+                    recipe_id=pk
+                ).select_related('neighbour').order_by(
+                    '-score', 'neighbour_id'
+                )
+            ],
+            context={'request': request},
+            many=True
+        ).data)
+
+    @action(
+        detail=False,
+        url_path='cache-stats',
+        permission_classes=(IsAdminUser,)
+    )
+    def cache_stats(self, request):
+        """Попадания в кэши, подсчитанные текущим процессом."""
+        return Response(
+            {**get_recipe_cache_stats(), 'tokens': token_cache.get_stats()}
         )
 
     @action(
@@ -211,9 +459,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
         permission_classes=(AllowAny,)
     )
     def get_short_link(view, request, pk):
-        if not Recipe.objects.filter(id=pk).exists():
-            raise serializers.ValidationError(
-                f'Рецепта не существует, id = {pk}'
-            )
-        return Response(
-            {'short-link': request.build_absolute_uri(f'/s/{pk}')})
+        if not pk.isdigit() or not recipe_id_index.exists(int(pk)):
+            raise Http404(f'Рецепта не существует, id = {pk}')
+        return Response({'short-link': request.build_absolute_uri(
+            f'/s/{encode_recipe_id(int(pk))}'
+        )})
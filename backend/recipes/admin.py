@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db.models import Count, Prefetch, Q
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
@@ -8,6 +10,9 @@ from .models import (
     Favourite, FoodgramUser, Ingredient, Recipe,
     RecipeIngredient, ShoppingCart, Subscription, Tag
 )
+from .images import get_variant_url
+from .search import get_matching_ids
+from .shopping_lists import apply_recipe_deltas, get_recipe_amounts
 
 
 class FoodgramUserFilter(admin.SimpleListFilter):
@@ -38,18 +43,25 @@ class CookingTimeFilter(admin.SimpleListFilter):
     title = 'Время готовки'
     parameter_name = 'cooking_time'
 
-    def get_filtered_recipes(self, param, queryset=Recipe.objects.all()):
+    COUNTS_CACHE_KEY = 'admin_cooking_time_counts'
+    COUNTS_CACHE_TIMEOUT = 60
+
+    def get_filtered_recipes(self, param, queryset):
         return queryset.filter(cooking_time__range=param)
 
+    def get_counts(self):
+        return Recipe.objects.aggregate(**{
+            name: Count('id', filter=Q(cooking_time__range=range))
+            for name, range in self.COOKING_TIME_RANGES.items()
+        })
+
     def lookups(self, request, model_admin):
+        counts = cache.get_or_set(
+            self.COUNTS_CACHE_KEY, self.get_counts, self.COUNTS_CACHE_TIMEOUT
+        )
         return [
-            (
-                name,
-                '{name}({count})'.format(
-                    name=name, count=self.get_filtered_recipes(range).count()
-                )
-            )
-            for name, range in self.COOKING_TIME_RANGES.items()
+            (name, '{name}({count})'.format(name=name, count=counts[name]))
+            for name in self.COOKING_TIME_RANGES
         ]
 
     def queryset(self, request, queryset):
@@ -89,7 +101,7 @@ class FoodgramUserAdmin(UserAdmin):
 
     @admin.display(description='Рецепты')
     def total_recipes(self, user):
-        count = user.recipes.count()
+        count = user.recipes_count
         if count > 0:
             url = reverse('admin:recipes_recipe_changelist')
             return mark_safe(
@@ -99,17 +111,20 @@ class FoodgramUserAdmin(UserAdmin):
 
     @admin.display(description='Подписчики')
     def total_subscribers(self, user):
-        return user.authors.count()
+        return user.subscribers_count
 
     @admin.display(description='Подписки')
     def total_subscriptions(self, user):
-        return user.subscribers.count()
+        return user.subscriptions_count
 
     @admin.display(description='Аватар')
     @mark_safe
     def get_avatar(self, user):
         if user.avatar:
-            return f'<img src={user.avatar.url} width="50" height="60">'
+            url = get_variant_url(
+                user.avatar, user.avatar_variants_source, 'thumbnail', 'jpeg'
+            )
+            return f'<img src={url} width="50" height="60">'
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -128,15 +143,46 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('total_in_favorites', 'get_image')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            Q(id__in=get_matching_ids(search_term))
+            | Q(author__username=search_term)
+        ), False
+
+    def save_related(self, request, form, formsets, change):
+        old_amounts = get_recipe_amounts((form.instance.id,), sign=-1)
+        super().save_related(request, form, formsets, change)
+        deltas = get_recipe_amounts((form.instance.id,))
+        for id, amount in old_amounts.items():
+            deltas[id] = deltas.get(id, 0) + amount
+        apply_recipe_deltas(form.instance.id, deltas)
+
     @admin.display(description='В избранном')
     def total_in_favorites(self, recipe):
-        return recipe.favourites.count()
+        return recipe.favorites_count
 
     @admin.display(description='Изображение')
     @mark_safe
     def get_image(self, recipe):
         if recipe.image:
-            return f'<img src={recipe.image.url} width="50" height="60">'
+            url = get_variant_url(
+                recipe.image, recipe.image_variants_source,
+                'thumbnail', 'jpeg'
+            )
+            return f'<img src={url} width="50" height="60">'
 
     @admin.display(description='Теги')
     @mark_safe
@@ -161,7 +207,7 @@ class IngredientAdmin(admin.ModelAdmin):
 
     @admin.display(description='Число рецептов')
     def total_recipes(self, ingredient):
-        return ingredient.recipeingredients.count()
+        return ingredient.recipes_count
 
 
 @admin.register(Subscription)
@@ -178,7 +224,7 @@ class TagAdmin(admin.ModelAdmin):
 
     @admin.display(description='Число рецептов')
     def total_recipes(self, tag):
-        return tag.recipes.count()
+        return tag.recipes_count
 
 
 @admin.register(Favourite)
@@ -4,3 +4,34 @@ MAX_PASSWORD_LENGTH = 128
 MIN_COOKING_TIME = 1
 MAX_RECIPE_NAME_LENGTH = 256
 MIN_AMOUNT = 1
+DEFAULT_RECIPES_LIMIT = 10
+MAX_RECIPES_LIMIT = 100
+# Не больше лимита параметров запроса в старых версиях SQLite (999).
+MAX_BULK_RECIPES = 500
+IMAGE_VARIANT_SIZES = {
+    'thumbnail': (160, 160),
+    'medium': (640, 640),
+}
+IMAGE_VARIANT_FORMATS = {
+    'webp': 'WEBP',
+    'jpeg': 'JPEG',
+}
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+IMAGE_UPLOAD_SPOOL_SIZE = 1024 * 1024
+IMAGE_MAX_PIXELS = 50_000_000
+IMAGE_FULL_DECODE_MAX_PIXELS = 16_000_000
+IMAGE_MAX_DIMENSION = 2560
+BASE64_CHUNK_SIZE = 64 * 1024
+FEED_FANOUT_MAX_SUBSCRIBERS = 5000
+FEED_BACKFILL_SIZE = 100
+FEED_BATCH_SIZE = 1000
+FEED_PULL_MARGIN = 60
+# Запас на транзакции, закоммиченные после начала прошлой выгрузки.
+EXPORT_OVERLAP = 300
+SIMILAR_RECIPES_COUNT = 10
+SIMILARITY_BATCH_SIZE = 500
+SIMILARITY_MAX_INGREDIENT_RECIPES = 2000
+SIMILARITY_CANDIDATES = 300
+INGREDIENT_FUZZY_THRESHOLD = 0.5
+INGREDIENT_FUZZY_LIMIT = 20
@@ -0,0 +1,57 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import (
+    Favourite, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    Subscription, Tag
+)
+
+# Модель: {поле счётчика: (модель связей, поле связи с моделью)}.
+COUNTERS = {
+    FoodgramUser: {
+        'recipes_count': (Recipe, 'author'),
+        'subscribers_count': (Subscription, 'author'),
+        'subscriptions_count': (Subscription, 'subscriber'),
+    },
+    Recipe: {
+        'favorites_count': (Favourite, 'recipe'),
+    },
+    Tag: {
+        'recipes_count': (Recipe.tags.through, 'tag'),
+    },
+    Ingredient: {
+        'recipes_count': (RecipeIngredient, 'ingredient'),
+    },
+}
+
+
+def change_counter(model, ids, field, delta):
+    """Атомарно меняет счётчик у объектов с переданными id."""
+    if not isinstance(ids, (list, tuple, set)):
+        ids = (ids,)
+    if ids and delta:
+        model.objects.filter(id__in=ids).update(**{field: F(field) + delta})
+
+
+def recount(model, field):
+    """Пересчитывает счётчик одним UPDATE; возвращает число расхождений."""
+    related_model, related_field = COUNTERS[model][field]
+    actual = Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    )
+    drifted = model.objects.annotate(actual=actual).exclude(
+        **{field: F('actual')}
+    )
+    drift = drifted.count()
+    if drift:
+        model.objects.filter(id__in=drifted.values('id')).update(
+            **{field: actual}
+        )
+    return drift
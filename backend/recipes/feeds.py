@@ -0,0 +1,122 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .constants import (
+    FEED_BACKFILL_SIZE, FEED_BATCH_SIZE, FEED_FANOUT_MAX_SUBSCRIBERS,
+    FEED_PULL_MARGIN
+)
+from .models import FoodgramUser, Recipe, Subscription, TimelineEntry
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='feeds')
+FEED_PULLED_AT_KEY = 'feed_pulled_at_{user_id}'
+
+
+def add_to_timelines(user_ids, recipes):
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                user_id=user_id, recipe_id=recipe_id, pub_date=pub_date
+            )
+            for user_id in user_ids
+            for recipe_id, pub_date in recipes
+        ],
+        batch_size=FEED_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def is_popular(author_id):
+    """Рецепты популярных авторов не рассылаются, а читаются из ленты."""
+    return FoodgramUser.objects.filter(
+        id=author_id, subscribers_count__gt=FEED_FANOUT_MAX_SUBSCRIBERS
+    ).exists()
+
+
+def fan_out_recipe(recipe_id, author_id, pub_date):
+    """Добавляет рецепт в ленты подписчиков автора пачками."""
+    try:
+        if is_popular(author_id):
+            return
+        subscriber_ids = []
+        for subscriber_id in Subscription.objects.filter(
+            author_id=author_id
+        ).values_list('subscriber_id', flat=True).iterator():
+            subscriber_ids.append(subscriber_id)
+            if len(subscriber_ids) == FEED_BATCH_SIZE:
+                add_to_timelines(subscriber_ids, ((recipe_id, pub_date),))
+                subscriber_ids = []
+        add_to_timelines(subscriber_ids, ((recipe_id, pub_date),))
+    except Exception:
+        logger.exception('Не удалось разослать рецепт %s', recipe_id)
+
+
+def schedule_fan_out(recipe):
+    transaction.on_commit(lambda: run_in_background(
+        executor, fan_out_recipe, recipe.id, recipe.author_id,
+        recipe.pub_date
+    ))
+
+
+def get_recent_recipes(author_ids, since=None):
+    recipes = Recipe.objects.filter(author_id__in=author_ids)
+    if since:
+        recipes = recipes.filter(pub_date__gte=since)
+    return recipes.order_by('-pub_date').values_list(
+        'id', 'pub_date'
+    )[:FEED_BACKFILL_SIZE]
+
+
+def backfill_timeline(subscriber_id, author_id):
+    add_to_timelines((subscriber_id,), get_recent_recipes((author_id,)))
+
+
+def prune_timeline(subscriber_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=subscriber_id, recipe__author_id=author_id
+    ).delete()
+
+
+def rebuild_timelines():
+    """Заполняет ленты заново по подпискам, по запросу на автора."""
+    TimelineEntry.objects.all().delete()
+    subscribers = {}
+    for subscriber_id, author_id in Subscription.objects.values_list(
+        'subscriber_id', 'author_id'
+    ).iterator():
+        subscribers.setdefault(author_id, []).append(subscriber_id)
+    for author_id, subscriber_ids in subscribers.items():
+        add_to_timelines(
+            subscriber_ids, list(get_recent_recipes((author_id,)))
+        )
+
+
+def pull_popular_recipes(user):
+    """Добавляет в ленту новые рецепты популярных авторов при чтении."""
+    author_ids = list(Subscription.objects.filter(
+        subscriber=user,
+        author__subscribers_count__gt=FEED_FANOUT_MAX_SUBSCRIBERS
+    ).values_list('author_id', flat=True))
+    if not author_ids:
+        return
+    key = FEED_PULLED_AT_KEY.format(user_id=user.id)
+    pulled_at = cache.get(key)
+    now = timezone.now()
+    # Запас на рецепты, сохранённые позже своей даты публикации.
+    add_to_timelines((user.id,), get_recent_recipes(
+        author_ids,
+        pulled_at and pulled_at - timedelta(seconds=FEED_PULL_MARGIN)
+    ))
+    cache.set(key, now, None)
+
+
+def get_timeline(user):
+    pull_popular_recipes(user)
+    return TimelineEntry.objects.filter(user=user)
@@ -0,0 +1,165 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.dispatch import Signal
+from PIL import Image
+
+from .constants import (
+    IMAGE_VARIANT_FORMATS, IMAGE_VARIANT_QUALITY, IMAGE_VARIANT_SIZES
+)
+from .models import FoodgramUser, Recipe
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Отправляется, когда копии изображения отмечены готовыми у рецептов
+# или аватаров (через update, без post_save), sender - Recipe,
+# аргумент - user_ids пользователей с этим аватаром.
+variants_created = Signal()
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='images'
+)
+pending_images = set()
+pending_lock = Lock()
+
+
+def get_variant_name(name, variant, file_format):
+    directory, filename = os.path.split(os.path.splitext(name)[0])
+    return os.path.join(
+        directory, 'variants', f'{filename}_{variant}.{file_format}'
+    )
+
+
+def get_variant_names(name):
+    return [
+        get_variant_name(name, variant, file_format)
+        for variant in IMAGE_VARIANT_SIZES
+        for file_format in IMAGE_VARIANT_FORMATS
+    ]
+
+
+def is_image_used(name):
+    return (
+        Recipe.objects.filter(image=name).exists()
+        or FoodgramUser.objects.filter(avatar=name).exists()
+    )
+
+
+def mark_variants_created(name):
+    """Отмечает копии готовыми у всех рецептов и аватаров с этим файлом."""
+    recipes_count = Recipe.objects.filter(image=name).exclude(
+        image_variants_source=name
+    ).update(image_variants_source=name)
+    user_ids = list(FoodgramUser.objects.filter(avatar=name).exclude(
+        avatar_variants_source=name
+    ).values_list('id', flat=True))
+    FoodgramUser.objects.filter(id__in=user_ids).update(
+        avatar_variants_source=name
+    )
+    if recipes_count or user_ids:
+        variants_created.send(sender=Recipe, user_ids=user_ids)
+
+
+def create_variants(name):
+    """Создаёт недостающие уменьшенные копии изображения.
+
+    Повторный вызов для того же файла только отмечает копии готовыми.
+    """
+    try:
+        if not is_image_used(name):
+            return
+        missing = [
+            (variant, file_format)
+            for variant in IMAGE_VARIANT_SIZES
+            for file_format in IMAGE_VARIANT_FORMATS
+            if not default_storage.exists(
+                get_variant_name(name, variant, file_format)
+            )
+        ]
+        if missing:
+            with default_storage.open(name) as file:
+                image = Image.open(file)
+                image.load()
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert(
+                    'RGBA' if 'A' in image.getbands() else 'RGB'
+                )
+        for variant, file_format in missing:
+            resized = image.copy()
+            resized.thumbnail(IMAGE_VARIANT_SIZES[variant])
+            if file_format == 'jpeg' and resized.mode != 'RGB':
+                resized = resized.convert('RGB')
+            content = BytesIO()
+            resized.save(
+                content,
+                IMAGE_VARIANT_FORMATS[file_format],
+                quality=IMAGE_VARIANT_QUALITY
+            )
+            default_storage.save(
+                get_variant_name(name, variant, file_format),
+                ContentFile(content.getvalue())
+            )
+        mark_variants_created(name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+    finally:
+        with pending_lock:
+            pending_images.discard(name)
+
+
+def schedule_variants(name):
+    with pending_lock:
+        if name in pending_images:
+            return
+        pending_images.add(name)
+    run_in_background(executor, create_variants, name)
+
+
+def delete_variants(name):
+    """Удаляет копии изображения, на которое больше никто не ссылается."""
+    if not name or is_image_used(name):
+        return
+    for variant_name in get_variant_names(name):
+        default_storage.delete(variant_name)
+
+
+def get_variant_url(image, variants_source, variant, file_format):
+    """URL копии изображения или оригинала, пока копии не готовы.
+
+    variants_source - имя файла, для которого копии уже созданы.
+    """
+    if image.name != variants_source:
+        schedule_variants(image.name)
+        return image.url
+    return default_storage.url(
+        get_variant_name(image.name, variant, file_format)
+    )
+
+
+def get_variant_urls(image, variants_source, request=None):
+    if not image:
+        return None
+    build_url = request.build_absolute_uri if request else str
+    if image.name != variants_source:
+        schedule_variants(image.name)
+        url = build_url(image.url)
+        return {
+            variant: dict.fromkeys(IMAGE_VARIANT_FORMATS, url)
+            for variant in IMAGE_VARIANT_SIZES
+        }
+    return {
+        variant: {
+            file_format: build_url(default_storage.url(
+                get_variant_name(image.name, variant, file_format)
+            ))
+            for file_format in IMAGE_VARIANT_FORMATS
+        }
+        for variant in IMAGE_VARIANT_SIZES
+    }
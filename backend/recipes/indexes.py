@@ -0,0 +1,283 @@
+from bisect import bisect_left
+from collections import Counter
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from .constants import INGREDIENT_FUZZY_THRESHOLD
+from .models import Ingredient, Recipe, RecipeIngredient
+
+
+class ProcessLocalIndex:
+    """Данные, которые строятся лениво и хранятся в памяти процесса.
+
+    Версия данных - пара (время изменения, случайный ключ) - хранится в
+    кэше Django, общем для всех процессов, поэтому сброс в одном процессе
+    (например, в команде импорта) приводит к перестроению во всех
+    остальных.
+    """
+
+    version_key = None
+
+    def __init__(self):
+        self._lock = Lock()
+        self._state = None, None
+
+    def invalidate(self):
+        self._state = None, None
+        cache.set(self.version_key, (int(time()), uuid4().hex), None)
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # Первый процесс задаёт версию, остальные читают её же.
+            cache.add(self.version_key, (int(time()), uuid4().hex), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def build(self):
+        raise NotImplementedError
+
+    def get_versioned_index(self):
+        """Возвращает данные вместе с версией, по которой они построены."""
+        version = self.get_version()
+        index, index_version = self._state
+        if index is None or index_version != version:
+            with self._lock:
+                index, index_version = self._state
+                if index is None or index_version != version:
+                    index = self.build()
+                    self._state = index, version
+        return index, version
+
+    def get_index(self):
+        return self.get_versioned_index()[0]
+
+
+class IngredientPrefixIndex(ProcessLocalIndex):
+    """Отсортированный индекс продуктов для поиска по началу названия."""
+
+    version_key = 'ingredient_index_version'
+
+    def build(self):
+        ingredients = sorted(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            key=lambda ingredient: (
+                ingredient['name'].casefold(), ingredient['id']
+            )
+        )
+        return (
+            [ingredient['name'].casefold() for ingredient in ingredients],
+            ingredients
+        )
+
+    def search(self, prefix, limit=None):
+        names, ingredients = self.get_index()
+        prefix = prefix.casefold()
+        start = bisect_left(names, prefix)
+        if prefix:
+            end = bisect_left(
+                names, prefix[:-1] + chr(ord(prefix[-1]) + 1), start
+            )
+        else:
+            end = len(names)
+        if limit is not None:
+            end = min(end, start + limit)
+        return ingredients[start:end]
+
+
+ingredient_prefix_index = IngredientPrefixIndex()
+
+
+def get_trigrams(text):
+    """Триграммы слов строки, как в pg_trgm: с отступами по краям слова."""
+    return {
+        padded[position:position + 3]
+        for word in text.casefold().split()
+        for padded in (f'  {word} ',)
+        for position in range(len(padded) - 2)
+    }
+
+
+class IngredientTrigramIndex(ProcessLocalIndex):
+    """Обратный индекс триграмма -> продукты для нечёткого поиска."""
+
+    version_key = 'ingredient_trigram_index_version'
+
+    def build(self):
+        ingredients = list(
+            Ingredient.objects.values('id', 'name', 'measurement_unit')
+        )
+        postings = {}
+        sizes = []
+        for position, ingredient in enumerate(ingredients):
+            trigrams = get_trigrams(ingredient['name'])
+            sizes.append(len(trigrams))
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(position)
+        return postings, sizes, ingredients
+
+    def search(self, query, limit=None):
+        """Продукты, содержащие большую часть триграмм запроса.
+
+        Порядок - по доле найденных триграмм запроса, затем по сходству
+        всего названия (короткие названия выше), затем по алфавиту.
+        """
+        postings, sizes, ingredients = self.get_index()
+        trigrams = get_trigrams(query)
+        if not trigrams:
+            return []
+        matches = Counter()
+        for trigram in trigrams:
+            matches.update(postings.get(trigram, ()))
+        minimum = INGREDIENT_FUZZY_THRESHOLD * len(trigrams)
+        ranked = sorted(
+            (
+                -shared,
+                -shared / (len(trigrams) + sizes[position] - shared),
+                ingredients[position]['name'],
+                position
+            )
+            for position, shared in matches.items()
+            if shared >= minimum
+        )
+        return [ingredients[item[-1]] for item in ranked[:limit]]
+
+
+ingredient_trigram_index = IngredientTrigramIndex()
+
+
+class RecipeIdIndex(ProcessLocalIndex):
+    """Множество id существующих рецептов для проверки без запроса к БД.
+
+    Индекс сбрасывается после создания и удаления рецептов, поэтому id,
+    которых в нём нет (в том числе больше максимального), отклоняются
+    без запроса к БД.
+    """
+
+    version_key = 'recipe_id_index_version'
+
+    def build(self):
+        return set(Recipe.objects.values_list('id', flat=True))
+
+    def exists(self, recipe_id):
+        return recipe_id in self.get_index()
+
+
+recipe_id_index = RecipeIdIndex()
+
+
+def count_bits(bitmap):
+    return bin(bitmap).count('1')
+
+
+def to_bitmap(ids):
+    """Битовая карта из списка id: одно преобразование в int на список."""
+    bitmap = bytearray(max(ids) // 8 + 1)
+    for id in ids:
+        bitmap[id >> 3] |= 1 << (id & 7)
+    return int.from_bytes(bitmap, 'little')
+
+
+class RankedRecipes:
+    """Рецепты, упорядоченные по числу недостающих продуктов.
+
+    Внутри группы с одинаковым числом недостающих продуктов новые
+    рецепты идут первыми. Элементы - пары (id рецепта, недостаёт).
+    Извлекаются только элементы запрошенного среза.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets.items())
+
+    def __len__(self):
+        return sum(count_bits(bitmap) for _, bitmap in self.buckets)
+
+    def __getitem__(self, key):
+        start, stop, _ = key.indices(len(self))
+        items = []
+        position = 0
+        for missing, bitmap in self.buckets:
+            size = count_bits(bitmap)
+            if position + size <= start:
+                position += size
+                continue
+            while bitmap and position < stop:
+                recipe_id = bitmap.bit_length() - 1
+                bitmap ^= 1 << recipe_id
+                if position >= start:
+                    items.append((recipe_id, missing))
+                position += 1
+            if position >= stop:
+                break
+        return items
+
+
+class RecipeIngredientIndex(ProcessLocalIndex):
+    """Обратный индекс продукт -> битовая карта рецептов.
+
+    Бит с номером id рецепта установлен, если рецепт содержит продукт.
+    Число совпавших продуктов считается сразу для всех рецептов
+    поразрядным сложением битовых карт.
+    """
+
+    version_key = 'recipe_ingredient_index_version'
+
+    def build(self):
+        recipe_ids = {}
+        sizes = Counter()
+        for recipe_id, ingredient_id in (
+            RecipeIngredient.objects.values_list(
+                'recipe_id', 'ingredient_id'
+            ).iterator()
+        ):
+            recipe_ids.setdefault(ingredient_id, []).append(recipe_id)
+            sizes[recipe_id] += 1
+        size_ids = {}
+        for recipe_id, size in sizes.items():
+            size_ids.setdefault(size, []).append(recipe_id)
+        return (
+            {
+                ingredient_id: to_bitmap(ids)
+                for ingredient_id, ids in recipe_ids.items()
+            },
+            {size: to_bitmap(ids) for size, ids in size_ids.items()}
+        )
+
+    def rank(self, ingredient_ids):
+        postings, size_bitmaps = self.get_index()
+        bitmaps = [
+            postings[ingredient_id]
+            for ingredient_id in set(ingredient_ids)
+            if ingredient_id in postings
+        ]
+        # Разряды счётчика совпадений для каждого рецепта.
+        digits = []
+        candidates = 0
+        for bitmap in bitmaps:
+            candidates |= bitmap
+            carry = bitmap
+            for position, digit in enumerate(digits):
+                digits[position], carry = digit ^ carry, digit & carry
+                if not carry:
+                    break
+            if carry:
+                digits.append(carry)
+        buckets = {}
+        for matched in range(1, min(len(bitmaps), 2 ** len(digits) - 1) + 1):
+            exact = candidates
+            for position, digit in enumerate(digits):
+                exact &= digit if matched >> position & 1 else ~digit
+            if not exact:
+                continue
+            for size, size_bitmap in size_bitmaps.items():
+                recipes = exact & size_bitmap
+                if recipes:
+                    missing = size - matched
+                    buckets[missing] = buckets.get(missing, 0) | recipes
+        return RankedRecipes(buckets)
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -0,0 +1,53 @@
+from timeit import timeit
+
+from django.core.management.base import BaseCommand
+
+from ...indexes import ingredient_prefix_index, ingredient_trigram_index
+from ...models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск продуктов через индекс в памяти и через ORM.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        names = Ingredient.objects.values_list('name', flat=True)
+        prefixes = sorted({
+            name[:length] for name in names for length in (1, 2, 3)
+        })
+        if not prefixes:
+            self.stdout.write('Справочник продуктов пуст.')
+            return
+        # Названия с пропущенной буквой - для нечёткого поиска.
+        typos = [name[:len(name) // 2] + name[len(name) // 2 + 1:]
+                 for name in names[:len(prefixes)]]
+        ingredient_prefix_index.get_index()
+        ingredient_trigram_index.get_index()
+
+        def search_orm():
+            for prefix in prefixes:
+                list(Ingredient.objects.filter(
+                    name__startswith=prefix
+                ).values('id', 'name', 'measurement_unit'))
+
+        def search_index():
+            for prefix in prefixes:
+                ingredient_prefix_index.search(prefix)
+
+        def search_fuzzy():
+            for typo in typos:
+                ingredient_trigram_index.search(typo, 20)
+
+        for title, search, count in (
+            ('ORM', search_orm, len(prefixes)),
+            ('Индекс', search_index, len(prefixes)),
+            ('Нечёткий поиск', search_fuzzy, len(typos)),
+        ):
+            total = count * options['repeat']
+            seconds = timeit(search, number=options['repeat'])
+            self.stdout.write(
+                f'{title}: {seconds / total * 10**6:.1f} мкс на запрос '
+                f'({total} запросов)'
+            )
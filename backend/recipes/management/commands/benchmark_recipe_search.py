@@ -0,0 +1,88 @@
+import random
+from timeit import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from ...models import FoodgramUser, Ingredient, Recipe, RecipeIngredient
+from ...search import search_recipes
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает полнотекстовый поиск рецептов с поиском через '
+        'icontains при росте числа рецептов. Добавленные рецепты '
+        'удаляются после замера.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=(1000, 10000, 50000)
+        )
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        author = FoodgramUser.objects.first()
+        ingredients = list(Ingredient.objects.values_list('id', 'name'))
+        if author is None or not ingredients:
+            raise CommandError('Нужны хотя бы один пользователь и продукты.')
+        randomizer = random.Random(0)
+        words = [word for _, name in ingredients for word in name.split()]
+        queries = [randomizer.choice(words) for _ in range(20)]
+        with transaction.atomic():
+            created = 0
+            for size in sorted(options['sizes']):
+                self.add_recipes(
+                    size - created, author, ingredients, words, randomizer
+                )
+                created = size
+                self.measure(Recipe.objects.count(), queries, options)
+            transaction.set_rollback(True)
+
+    def add_recipes(self, count, author, ingredients, words, randomizer):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=' '.join(randomizer.sample(words, 3)),
+                text=' '.join(randomizer.choices(words, k=30)),
+                cooking_time=randomizer.randint(1, 120),
+                image='recipes/images/benchmark.png'
+            )
+            for _ in range(count)
+        )
+        if not recipes or recipes[0].id is None:
+            recipes = Recipe.objects.order_by('-id')[:count]
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id, amount=1
+            )
+            for recipe in recipes
+            for ingredient_id, _ in randomizer.sample(ingredients, 5)
+        )
+
+    def measure(self, total, queries, options):
+        def search_fulltext():
+            for query in queries:
+                list(search_recipes(
+                    Recipe.objects.all(), query
+                ).values_list('id', flat=True)[:6])
+
+        def search_icontains():
+            for query in queries:
+                list(Recipe.objects.filter(
+                    Q(name__icontains=query)
+                    | Q(text__icontains=query)
+                    | Q(ingredients__name__icontains=query)
+                ).distinct().values_list('id', flat=True)[:6])
+
+        count = len(queries) * options['repeat']
+        for title, search in (
+            ('Полнотекстовый', search_fulltext),
+            ('icontains', search_icontains),
+        ):
+            seconds = timeit(search, number=options['repeat'])
+            self.stdout.write(
+                f'{total} рецептов, {title}: '
+                f'{seconds / count * 1000:.2f} мс на запрос'
+            )
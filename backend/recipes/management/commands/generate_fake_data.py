@@ -0,0 +1,299 @@
+import random
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+from time import monotonic
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from ...counters import COUNTERS, recount
+from ...feeds import rebuild_timelines
+from ...images import schedule_variants
+from ...models import (
+    Favourite, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Subscription, Tag
+)
+from ...shopping_lists import rebuild_shopping_lists
+from ...signals import catalogue_imported
+
+IMAGE_NAME = 'recipes/images/fake.png'
+PASSWORD = 'fake-password'
+# Сколько раундов подряд без новых пар допускается при их наборе.
+MAX_IDLE_ROUNDS = 10
+
+
+class PowerLaw:
+    """Выбор id с вероятностью, убывающей как 1 / ранг ** exponent.
+
+    Ранги назначаются id в случайном порядке, поэтому популярность
+    не связана с порядком создания.
+    """
+
+    def __init__(self, ids, randomizer, exponent=1.0):
+        self.ids = list(ids)
+        randomizer.shuffle(self.ids)
+        self.cum_weights = list(accumulate(
+            1 / rank ** exponent for rank in range(1, len(self.ids) + 1)
+        ))
+        self.randomizer = randomizer
+
+    def sample(self, count):
+        return self.randomizer.choices(
+            self.ids, cum_weights=self.cum_weights, k=count
+        )
+
+    def sample_unique(self, count):
+        ids = set(self.sample(count))
+        return ids if ids else set(self.sample(1))
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт пользователей, рецепты, избранное, корзины и подписки '
+        'для нагрузочной проверки. Популярность авторов, рецептов и '
+        'продуктов подчиняется степенному закону; при одинаковом --seed '
+        'и пустой базе данные совпадают. Пароль пользователей - '
+        f'{PASSWORD}.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--favorites', type=int, default=50000)
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--subscriptions', type=int, default=20000)
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Даты публикации рецептов распределяются по этому '
+                 'числу последних дней.'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='fake',
+            help='Начало имён пользователей, должно быть новым для базы.'
+        )
+
+    def report(self, title, count, started):
+        seconds = monotonic() - started
+        self.stdout.write(
+            f'{title}: {count} ({count / max(seconds, 1e-6):.0f} в секунду)'
+        )
+
+    def create_in_batches(self, model, objects, batch_size, **kwargs):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == batch_size:
+                with transaction.atomic():
+                    model.objects.bulk_create(batch, **kwargs)
+                batch = []
+        with transaction.atomic():
+            model.objects.bulk_create(batch, **kwargs)
+
+    def get_new_ids(self, model, last_id):
+        return list(model.objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).values_list('id', flat=True))
+
+    def get_last_id(self, model):
+        last = model.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first()
+        return last or 0
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        if FoodgramUser.objects.filter(
+            username__startswith=prefix
+        ).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'укажите другой --prefix.'
+            )
+        password = make_password(PASSWORD)
+        last_id = self.get_last_id(FoodgramUser)
+        self.create_in_batches(
+            FoodgramUser,
+            (
+                FoodgramUser(
+                    username=f'{prefix}{number}',
+                    email=f'{prefix}{number}@example.com',
+                    first_name='Имя',
+                    last_name=f'Фамилия {number}',
+                    password=password
+                )
+                for number in range(options['users'])
+            ),
+            options['batch_size']
+        )
+        return self.get_new_ids(FoodgramUser, last_id)
+
+    def create_image(self):
+        if not default_storage.exists(IMAGE_NAME):
+            content = BytesIO()
+            Image.new('RGB', (640, 480), (230, 200, 160)).save(content, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(content.getvalue()))
+
+    def create_recipes(self, user_ids, randomizer, options):
+        ingredients = list(
+            Ingredient.objects.order_by('id').values_list('id', 'name')
+        )
+        tag_ids = list(
+            Tag.objects.order_by('id').values_list('id', flat=True)
+        )
+        words = [word for _, name in ingredients for word in name.split()]
+        authors = PowerLaw(user_ids, randomizer, exponent=1.2)
+        popular_ingredients = PowerLaw(
+            [id for id, _ in ingredients], randomizer
+        )
+        popular_tags = PowerLaw(tag_ids, randomizer, exponent=0.5)
+        self.create_image()
+        # Даты возрастают вместе с id, как у рецептов, созданных по очереди.
+        now = timezone.now()
+        pub_dates = iter(sorted(
+            now - timedelta(days=randomizer.uniform(0, options['days']))
+            for _ in range(options['recipes'])
+        ))
+        recipe_ids = []
+        remaining = options['recipes']
+        while remaining:
+            count = min(remaining, options['batch_size'])
+            remaining -= count
+            last_id = self.get_last_id(Recipe)
+            with transaction.atomic():
+                Recipe.objects.bulk_create(
+                    Recipe(
+                        author_id=author_id,
+                        name=' '.join(
+                            randomizer.sample(words, 2)
+                        ).capitalize(),
+                        text=' '.join(randomizer.choices(words, k=20)),
+                        cooking_time=max(
+                            1, int(randomizer.lognormvariate(3.4, 0.6))
+                        ),
+                        image=IMAGE_NAME
+                    )
+                    for author_id in authors.sample(count)
+                )
+                batch_ids = self.get_new_ids(Recipe, last_id)
+                # pub_date заполняется при создании (auto_now_add).
+                Recipe.objects.bulk_update(
+                    [
+                        Recipe(id=recipe_id, pub_date=date, updated_at=date)
+                        for recipe_id, date in zip(batch_ids, pub_dates)
+                    ],
+                    ('pub_date', 'updated_at'),
+                    batch_size=1000
+                )
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=randomizer.choice((1, 2, 5, 10, 50, 100, 200))
+                    )
+                    for recipe_id in batch_ids
+                    for ingredient_id in popular_ingredients.sample_unique(
+                        randomizer.randint(3, 12)
+                    )
+                )
+                Recipe.tags.through.objects.bulk_create(
+                    Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                    for recipe_id in batch_ids
+                    for tag_id in popular_tags.sample_unique(
+                        randomizer.randint(1, 3)
+                    )
+                )
+            recipe_ids.extend(batch_ids)
+        # Копии отмечаются готовыми у рецептов, уже ссылающихся на файл.
+        schedule_variants(IMAGE_NAME)
+        return recipe_ids
+
+    def sample_pairs(self, count, left, right, allow_same):
+        """Набирает count различных пар, досэмплируя вместо повторов.
+
+        Если новые пары перестают находиться, их остаётся меньше count.
+        """
+        pairs = set()
+        idle_rounds = 0
+        while len(pairs) < count and idle_rounds < MAX_IDLE_ROUNDS:
+            needed = count - len(pairs)
+            found = len(pairs)
+            pairs.update(
+                pair
+                for pair in zip(left.sample(needed), right.sample(needed))
+                if allow_same or pair[0] != pair[1]
+            )
+            idle_rounds = idle_rounds + 1 if len(pairs) == found else 0
+        return pairs
+
+    def create_pairs(self, model, fields, count, left, right, options):
+        """Создаёт count уникальных пар."""
+        left_field, right_field = fields
+        existing = model.objects.count()
+        self.create_in_batches(
+            model,
+            (
+                model(**{left_field: left_id, right_field: right_id})
+                for left_id, right_id in self.sample_pairs(
+                    count, left, right, allow_same=model is not Subscription
+                )
+            ),
+            options['batch_size'],
+            ignore_conflicts=True
+        )
+        return model.objects.count() - existing
+
+    def handle(self, *args, **options):
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            raise CommandError(
+                'Сначала загрузите продукты и теги командой import_catalogue.'
+            )
+        randomizer = random.Random(options['seed'])
+        started = monotonic()
+        user_ids = self.create_users(options)
+        self.report('Пользователи', len(user_ids), started)
+        if not user_ids:
+            return
+        started = monotonic()
+        recipe_ids = self.create_recipes(user_ids, randomizer, options)
+        self.report('Рецепты', len(recipe_ids), started)
+        users = PowerLaw(user_ids, randomizer)
+        if recipe_ids:
+            recipes = PowerLaw(recipe_ids, randomizer)
+            for title, model, option in (
+                ('Избранное', Favourite, 'favorites'),
+                ('Корзины', ShoppingCart, 'carts'),
+            ):
+                started = monotonic()
+                self.report(title, self.create_pairs(
+                    model, ('user_id', 'recipe_id'), options[option],
+                    users, recipes, options
+                ), started)
+        started = monotonic()
+        self.report('Подписки', self.create_pairs(
+            Subscription, ('subscriber_id', 'author_id'),
+            options['subscriptions'], users,
+            PowerLaw(user_ids, randomizer, exponent=1.2), options
+        ), started)
+        started = monotonic()
+        # bulk_create не вызывает сигналы: производные данные
+        # пересчитываются целиком.
+        for model, fields in COUNTERS.items():
+            for field in fields:
+                recount(model, field)
+        with transaction.atomic():
+            rebuild_shopping_lists()
+            rebuild_timelines()
+        catalogue_imported.send(sender=Recipe)
+        self.stdout.write(
+            'Счётчики, списки покупок и ленты пересчитаны за '
+            f'{monotonic() - started:.1f} с. Похожие рецепты '
+            'пересчитываются отдельно: rebuild_similar_recipes.'
+        )
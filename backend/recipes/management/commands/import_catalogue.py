@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from .utils import CATALOGUES, FILE_FORMATS, import_catalogue
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает справочник продуктов или тегов из CSV, JSON или JSONL. '
+        'Существующие записи обновляются, повторная загрузка ничего '
+        'не меняет.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('catalogue', choices=tuple(CATALOGUES))
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=FILE_FORMATS,
+            help='Формат файла, по умолчанию - по расширению.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def progress(self, processed, seconds):
+        self.stdout.write(
+            f'Обработано {processed} записей, '
+            f'{processed / max(seconds, 1e-6):.0f} записей/с'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            processed, created, updated = import_catalogue(
+                options['path'],
+                options['catalogue'],
+                file_format=options['format'],
+                batch_size=options['batch_size'],
+                progress=self.progress
+            )
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось загрузить справочник: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {processed} записей, добавлено {created}, '
+            f'обновлено {updated}'
+        ))
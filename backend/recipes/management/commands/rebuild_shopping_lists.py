@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import ShoppingListItem
+from ...shopping_lists import calculate_shopping_lists, rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок пользователей и проверяет их.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сравнить списки с корзинами, ничего не меняя.'
+        )
+
+    def get_mismatches(self):
+        expected = calculate_shopping_lists()
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total'
+            )
+        }
+        return {
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        }
+
+    def handle(self, *args, **options):
+        mismatches = self.get_mismatches()
+        self.stdout.write(f'Расхождений: {len(mismatches)}')
+        if options['check']:
+            return
+        with transaction.atomic():
+            rebuild_shopping_lists()
+        mismatches = self.get_mismatches()
+        if mismatches:
+            self.stderr.write(
+                f'После пересчёта осталось расхождений: {len(mismatches)}'
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS('Списки покупок пересчитаны'))
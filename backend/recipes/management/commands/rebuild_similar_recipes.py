@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ...similarity import rebuild_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих рецептов.'
+
+    def progress(self, processed, total):
+        self.stdout.write(f'Обработано рецептов: {processed} из {total}')
+
+    def handle(self, *args, **options):
+        total = rebuild_neighbours(progress=self.progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово, рецептов: {total}'
+        ))
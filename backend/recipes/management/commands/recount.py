@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ...counters import COUNTERS, recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики рецептов, избранного и подписок.'
+
+    def handle(self, *args, **options):
+        for model, fields in COUNTERS.items():
+            for field in fields:
+                drift = recount(model, field)
+                self.stdout.write(
+                    f'{model.__name__}.{field}: исправлено {drift}'
+                )
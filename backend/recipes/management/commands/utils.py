@@ -1,11 +1,202 @@
+import csv
+import io
 import json
-from csv import DictReader
+import os
+from time import monotonic
+
+from django.db import connection, transaction
+
+from ...models import Ingredient, Tag
+from ...signals import catalogue_imported
+
+# Справочник: (модель, поля ключа, обновляемые поля).
+CATALOGUES = {
+    'ingredients': (Ingredient, ('name', 'measurement_unit'), ()),
+    'tags': (Tag, ('slug',), ('name',)),
+}
+FILE_FORMATS = ('csv', 'json', 'jsonl')
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK_SIZE):
+    """Читает элементы JSON-массива по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while not eof:
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        position = 0
+        if not started:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            if buffer[0] != '[':
+                raise ValueError('Ожидается JSON-массив')
+            started = True
+            position = 1
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break
+            yield record
+        buffer = buffer[position:]
+    raise ValueError('Неожиданный конец JSON-массива')
+
+
+def read_records(file, file_format):
+    if file_format == 'csv':
+        return csv.DictReader(file)
+    if file_format == 'jsonl':
+        return (json.loads(line) for line in file if line.strip())
+    return iter_json_array(file)
+
+
+def iter_batches(records, batch_size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_batch(model, key_fields, update_fields, records):
+    """Добавляет новые и обновляет изменённые записи через ORM."""
+    fields = (*key_fields, *update_fields)
+    records = {
+        tuple(record[field] for field in key_fields): record
+        for record in records
+    }
+    existing = {
+        tuple(getattr(obj, field) for field in key_fields): obj
+        for obj in model.objects.filter(**{
+            f'{key_fields[0]}__in': {key[0] for key in records}
+        })
+    }
+    to_create = []
+    to_update = []
+    for key, record in records.items():
+        obj = existing.get(key)
+        if obj is None:
+            to_create.append(model(**{
+                field: record[field] for field in fields
+            }))
+        elif any(
+            getattr(obj, field) != record[field] for field in update_fields
+        ):
+            for field in update_fields:
+                setattr(obj, field, record[field])
+            to_update.append(obj)
+    model.objects.bulk_create(to_create)
+    if to_update:
+        model.objects.bulk_update(to_update, update_fields)
+    return len(to_create), len(to_update)
+
+
+def copy_upsert_batch(model, key_fields, update_fields, records, cursor):
+    """Загружает записи через COPY во временную таблицу PostgreSQL."""
+    quote = connection.ops.quote_name
+    fields = (*key_fields, *update_fields)
+    columns = ', '.join(quote(field) for field in fields)
+    table = quote(model._meta.db_table)
+    defaults = {
+        field.column: field.get_default()
+        for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in fields
+    }
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow(record[field] for field in fields)
+    buffer.seek(0)
+    cursor.execute(
+        f'CREATE TEMP TABLE IF NOT EXISTS catalogue_staging '
+        f'ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+    )
+    cursor.execute('TRUNCATE catalogue_staging')
+    cursor.copy_expert(
+        f'COPY catalogue_staging ({columns}) FROM STDIN WITH CSV', buffer
+    )
+    if update_fields:
+        conflict_action = 'DO UPDATE SET {} WHERE {}'.format(
+            ', '.join(
+                f'{quote(field)} = EXCLUDED.{quote(field)}'
+                for field in update_fields
+            ),
+            ' OR '.join(
+                f'{table}.{quote(field)} IS DISTINCT FROM '
+                f'EXCLUDED.{quote(field)}'
+                for field in update_fields
+            )
+        )
+    else:
+        conflict_action = 'DO NOTHING'
+    default_columns = ''.join(
+        f', {quote(column)}' for column in defaults
+    )
+    cursor.execute(
+        f'INSERT INTO {table} ({columns}{default_columns}) '
+        f'SELECT DISTINCT ON ({", ".join(quote(f) for f in key_fields)}) '
+        f'{columns}{", %s" * len(defaults)} FROM catalogue_staging '
+        f'ON CONFLICT ({", ".join(quote(f) for f in key_fields)}) '
+        f'{conflict_action}',
+        list(defaults.values())
+    )
+    return cursor.rowcount, 0
+
+
+def import_catalogue(
+    path, catalogue, file_format=None, batch_size=1000, progress=None
+):
+    """Потоково загружает справочник пачками по batch_size записей.
+
+    Возвращает число обработанных, добавленных и обновлённых записей.
+    На PostgreSQL добавленные и обновлённые записи считаются вместе.
+    """
+    model, key_fields, update_fields = CATALOGUES[catalogue]
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.')
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f'Неизвестный формат файла: {file_format}')
+    processed = created = updated = 0
+    started = monotonic()
+    with open(path, encoding='utf-8') as file, transaction.atomic():
+        with connection.cursor() as cursor:
+            for batch in iter_batches(
+                read_records(file, file_format), batch_size
+            ):
+                if connection.vendor == 'postgresql':
+                    batch_created, batch_updated = copy_upsert_batch(
+                        model, key_fields, update_fields, batch, cursor
+                    )
+                else:
+                    batch_created, batch_updated = upsert_batch(
+                        model, key_fields, update_fields, batch
+                    )
+                processed += len(batch)
+                created += batch_created
+                updated += batch_updated
+                if progress:
+                    progress(processed, monotonic() - started)
+    if created or updated:
+        catalogue_imported.send(sender=model)
+    return processed, created, updated
 
 
 def import_objects(filename, file_format, model):
-    with open(
-        f'data/{filename}.{file_format}', 'r', encoding='utf-8'
-    ) as file:
-        reader = json.load if file_format == 'json' else DictReader
-        objects_list = [model(**record) for record in reader(file)]
-        model.objects.bulk_create(objects_list, ignore_conflicts=True)
+    catalogue = {
+        catalogue_model: name
+        for name, (catalogue_model, _, _) in CATALOGUES.items()
+    }[model]
+    return import_catalogue(f'data/{filename}.{file_format}', catalogue)
@@ -0,0 +1,71 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:35
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('FoodgramUser', 'recipes_count', 'Recipe', 'author'),
+    ('FoodgramUser', 'subscribers_count', 'Subscription', 'author'),
+    ('FoodgramUser', 'subscriptions_count', 'Subscription', 'subscriber'),
+    ('Recipe', 'favorites_count', 'Favourite', 'recipe'),
+    ('Tag', 'recipes_count', 'Recipe_tags', 'tag'),
+    ('Ingredient', 'recipes_count', 'RecipeIngredient', 'ingredient'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model_name, field, related_name, related_field in COUNTERS:
+        related_model = apps.get_model('recipes', related_name)
+        apps.get_model('recipes', model_name).objects.update(**{
+            field: Coalesce(
+                models.Subquery(
+                    related_model.objects.filter(
+                        **{related_field: models.OuterRef('pk')}
+                    ).order_by().values(related_field).annotate(
+                        total=models.Count('pk')
+                    ).values('total')
+                ),
+                models.Value(0)
+            )
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Число рецептов'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='subscribers_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Число подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='subscriptions_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Число подписок'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Число рецептов'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipes_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Число рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
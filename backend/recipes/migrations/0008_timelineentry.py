@@ -0,0 +1,63 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Значения на момент создания миграции.
+FEED_BACKFILL_SIZE = 100
+
+
+def fill_timelines(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscription = apps.get_model('recipes', 'Subscription')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    for subscription in Subscription.objects.iterator():
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(
+                    user_id=subscription.subscriber_id,
+                    recipe_id=recipe_id,
+                    pub_date=pub_date
+                )
+                for recipe_id, pub_date in Recipe.objects.filter(
+                    author_id=subscription.author_id
+                ).order_by('-pub_date').values_list(
+                    'id', 'pub_date'
+                )[:FEED_BACKFILL_SIZE]
+            ],
+            ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации рецепта')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timelineentries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timelineentries', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи лент',
+                'default_related_name': 'timelineentries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_timelineentry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
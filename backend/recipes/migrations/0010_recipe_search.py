@@ -0,0 +1,242 @@
+# Generated by Django 3.2.3 on 2026-10-18 10:05
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+import recipes.models
+
+# Внешний ключ на recipes_recipe мешал бы TRUNCATE таблицы рецептов (flush,
+# TransactionTestCase), поэтому поисковые документы удаляются триггерами.
+POSTGRESQL_FORWARD = (
+    '''
+    CREATE TABLE recipes_recipe_search (
+        recipe_id bigint PRIMARY KEY,
+        document tsvector NOT NULL
+    )
+    ''',
+    '''
+    CREATE INDEX recipes_recipe_search_document_idx
+        ON recipes_recipe_search USING GIN (document)
+    ''',
+    '''
+    CREATE FUNCTION recipes_refresh_recipe_search(target bigint)
+    RETURNS void AS $$
+        INSERT INTO recipes_recipe_search (recipe_id, document)
+        SELECT recipe.id,
+            setweight(to_tsvector('russian', recipe.name), 'A')
+            || setweight(to_tsvector('russian', coalesce((
+                SELECT string_agg(ingredient.name, ' ')
+                FROM recipes_recipeingredient AS item
+                JOIN recipes_ingredient AS ingredient
+                    ON ingredient.id = item.ingredient_id
+                WHERE item.recipe_id = recipe.id
+            ), '')), 'B')
+            || setweight(to_tsvector('russian', recipe.text), 'C')
+        FROM recipes_recipe AS recipe
+        WHERE recipe.id = target
+        ON CONFLICT (recipe_id) DO UPDATE SET document = EXCLUDED.document
+    $$ LANGUAGE sql
+    ''',
+    '''
+    CREATE FUNCTION recipes_recipe_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            TRUNCATE recipes_recipe_search;
+        ELSIF TG_TABLE_NAME = 'recipes_recipe' THEN
+            IF TG_OP = 'DELETE' THEN
+                DELETE FROM recipes_recipe_search WHERE recipe_id = OLD.id;
+            ELSE
+                PERFORM recipes_refresh_recipe_search(NEW.id);
+            END IF;
+        ELSIF TG_TABLE_NAME = 'recipes_recipeingredient' THEN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM recipes_refresh_recipe_search(OLD.recipe_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM recipes_refresh_recipe_search(NEW.recipe_id);
+            END IF;
+        ELSE
+            PERFORM recipes_refresh_recipe_search(recipe_id)
+            FROM recipes_recipeingredient
+            WHERE ingredient_id = NEW.id;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_recipe
+    AFTER INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_trigger()
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_recipe_delete
+    AFTER DELETE ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_trigger()
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_recipe_truncate
+    AFTER TRUNCATE ON recipes_recipe
+    FOR EACH STATEMENT EXECUTE PROCEDURE recipes_recipe_search_trigger()
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_recipeingredient
+    AFTER INSERT OR UPDATE OR DELETE ON recipes_recipeingredient
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_trigger()
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_search_ingredient
+    AFTER UPDATE OF name ON recipes_ingredient
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_trigger()
+    ''',
+    'SELECT recipes_refresh_recipe_search(id) FROM recipes_recipe',
+)
+POSTGRESQL_BACKWARD = (
+    'DROP TRIGGER recipes_recipe_search_ingredient ON recipes_ingredient',
+    'DROP TRIGGER recipes_recipe_search_recipeingredient '
+    'ON recipes_recipeingredient',
+    'DROP TRIGGER recipes_recipe_search_recipe_truncate ON recipes_recipe',
+    'DROP TRIGGER recipes_recipe_search_recipe_delete ON recipes_recipe',
+    'DROP TRIGGER recipes_recipe_search_recipe ON recipes_recipe',
+    'DROP FUNCTION recipes_recipe_search_trigger()',
+    'DROP FUNCTION recipes_refresh_recipe_search(bigint)',
+    'DROP TABLE recipes_recipe_search',
+)
+
+SQLITE_INGREDIENTS = '''
+    (
+        SELECT group_concat(ingredient.name, ' ')
+        FROM recipes_recipeingredient AS item
+        JOIN recipes_ingredient AS ingredient
+            ON ingredient.id = item.ingredient_id
+        WHERE item.recipe_id = {recipe_id}
+    )
+'''
+SQLITE_REFRESH = '''
+    UPDATE recipes_recipe_fts
+    SET ingredients = coalesce({ingredients}, '')
+    WHERE rowid = {{recipe_id}};
+'''.format(ingredients=SQLITE_INGREDIENTS.format(recipe_id='{recipe_id}'))
+SQLITE_FORWARD = (
+    '''
+    CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, text, ingredients, tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_recipe_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients)
+        VALUES (NEW.id, NEW.name, NEW.text, '');
+    END
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_recipe_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        UPDATE recipes_recipe_fts SET name = NEW.name, text = NEW.text
+        WHERE rowid = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_recipe_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        DELETE FROM recipes_recipe_fts WHERE rowid = OLD.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER recipes_recipe_fts_recipeingredient_insert
+    AFTER INSERT ON recipes_recipeingredient BEGIN
+        {}
+    END
+    '''.format(SQLITE_REFRESH.format(recipe_id='NEW.recipe_id')),
+    '''
+    CREATE TRIGGER recipes_recipe_fts_recipeingredient_update
+    AFTER UPDATE OF recipe_id, ingredient_id ON recipes_recipeingredient
+    BEGIN
+        {}
+        {}
+    END
+    '''.format(
+        SQLITE_REFRESH.format(recipe_id='OLD.recipe_id'),
+        SQLITE_REFRESH.format(recipe_id='NEW.recipe_id')
+    ),
+    '''
+    CREATE TRIGGER recipes_recipe_fts_recipeingredient_delete
+    AFTER DELETE ON recipes_recipeingredient BEGIN
+        {}
+    END
+    '''.format(SQLITE_REFRESH.format(recipe_id='OLD.recipe_id')),
+    '''
+    CREATE TRIGGER recipes_recipe_fts_ingredient_update
+    AFTER UPDATE OF name ON recipes_ingredient BEGIN
+        UPDATE recipes_recipe_fts
+        SET ingredients = coalesce({}, '')
+        WHERE rowid IN (
+            SELECT recipe_id FROM recipes_recipeingredient
+            WHERE ingredient_id = NEW.id
+        );
+    END
+    '''.format(SQLITE_INGREDIENTS.format(
+        recipe_id='recipes_recipe_fts.rowid'
+    )),
+    '''
+    INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients)
+    SELECT id, name, text, coalesce({}, '') FROM recipes_recipe
+    '''.format(SQLITE_INGREDIENTS.format(recipe_id='recipes_recipe.id')),
+)
+SQLITE_BACKWARD = (
+    'DROP TRIGGER recipes_recipe_fts_ingredient_update',
+    'DROP TRIGGER recipes_recipe_fts_recipeingredient_delete',
+    'DROP TRIGGER recipes_recipe_fts_recipeingredient_update',
+    'DROP TRIGGER recipes_recipe_fts_recipeingredient_insert',
+    'DROP TRIGGER recipes_recipe_fts_recipe_delete',
+    'DROP TRIGGER recipes_recipe_fts_recipe_update',
+    'DROP TRIGGER recipes_recipe_fts_recipe_insert',
+    'DROP TABLE recipes_recipe_fts',
+)
+STATEMENTS = {
+    'postgresql': (POSTGRESQL_FORWARD, POSTGRESQL_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def run_statements(direction):
+    def run(apps, schema_editor):
+        statements = STATEMENTS.get(schema_editor.connection.vendor)
+        if statements:
+            for statement in statements[direction]:
+                schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipeneighbour'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_statements(0), run_statements(1)),
+        migrations.CreateModel(
+            name='RecipeFtsDocument',
+            fields=[
+                ('recipe', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='fts_document', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('document', recipes.models.Fts5DocumentField(db_column='recipes_recipe_fts', verbose_name='Поисковый документ')),
+            ],
+            options={
+                'db_table': 'recipes_recipe_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RecipeSearchDocument',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('document', django.contrib.postgres.search.SearchVectorField(verbose_name='Поисковый документ')),
+            ],
+            options={
+                'db_table': 'recipes_recipe_search',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.3 on 2026-10-18 03:50
+
+from django.db import migrations, models
+
+FIELDS = (
+    ('foodgramuser', 'avatar_variants_source'),
+    ('recipe', 'image_variants_source'),
+)
+
+
+def get_fields(apps):
+    for model_name, field_name in FIELDS:
+        model = apps.get_model('recipes', model_name)
+        field = models.CharField(max_length=100, blank=True)
+        field.set_attributes_from_name(field_name)
+        field.model = model
+        yield model, field
+
+
+# На SQLite AddField пересоздаёт таблицу и теряет поисковые триггеры
+# на recipes_recipe (миграция 0010), поэтому столбцы добавляются ALTER TABLE.
+def add_columns(apps, schema_editor):
+    for model, field in get_fields(apps):
+        if schema_editor.connection.vendor != 'sqlite':
+            schema_editor.add_field(model, field)
+            continue
+        schema_editor.execute(
+            f'ALTER TABLE {schema_editor.quote_name(model._meta.db_table)} '
+            f'ADD COLUMN {schema_editor.quote_name(field.column)} '
+            f"varchar({field.max_length}) NOT NULL DEFAULT ''"
+        )
+
+
+def remove_columns(apps, schema_editor):
+    for model, field in get_fields(apps):
+        if schema_editor.connection.vendor != 'sqlite':
+            schema_editor.remove_field(model, field)
+            continue
+        schema_editor.execute(
+            f'ALTER TABLE {schema_editor.quote_name(model._meta.db_table)} '
+            f'DROP COLUMN {schema_editor.quote_name(field.column)}'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_search'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='foodgramuser',
+                    name='avatar_variants_source',
+                    field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Аватар с готовыми копиями'),
+                ),
+                migrations.AddField(
+                    model_name='recipe',
+                    name='image_variants_source',
+                    field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Изображение с готовыми копиями'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_columns, remove_columns),
+            ],
+        ),
+    ]
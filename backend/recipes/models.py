@@ -1,4 +1,5 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 
@@ -9,7 +10,31 @@ from .constants import (
 from .validators import validate_username
 
 
-class FoodgramUser(AbstractUser):
+class CounterFieldsMixin:
+    """Не перезаписывает счётчики при сохранении объекта целиком.
+
+    Счётчики меняются только UPDATE с F(), а объект в памяти мог быть
+    загружен до такого изменения.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (
+            not args
+            and not self._state.adding
+            and not kwargs.get('force_insert')
+            and kwargs.get('update_fields') is None
+        ):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class FoodgramUser(CounterFieldsMixin, AbstractUser):
     email = models.EmailField(
         verbose_name='Электронная почта',
         max_length=MAX_EMAIL_LENGTH,
@@ -54,7 +79,31 @@ class FoodgramUser(AbstractUser):
         null=True,
         blank=True,
     )
+    avatar_variants_source = models.CharField(
+        verbose_name='Аватар с готовыми копиями',
+        max_length=100,
+        blank=True,
+        editable=False
+    )
+    recipes_count = models.IntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False
+    )
+    subscribers_count = models.IntegerField(
+        verbose_name='Число подписчиков',
+        default=0,
+        editable=False
+    )
+    subscriptions_count = models.IntegerField(
+        verbose_name='Число подписок',
+        default=0,
+        editable=False
+    )
 
+    counter_fields = (
+        'recipes_count', 'subscribers_count', 'subscriptions_count'
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
 
@@ -95,7 +144,7 @@ class Subscription(models.Model):
         return f'Подписка {self.subscriber} на {self.author}'
 
 
-class Tag(models.Model):
+class Tag(CounterFieldsMixin, models.Model):
     name = models.CharField(
         verbose_name='Название',
         max_length=32,
@@ -108,6 +157,13 @@ class Tag(models.Model):
         unique=True,
         help_text='Укажите ярлык'
     )
+    recipes_count = models.IntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('recipes_count',)
 
     class Meta:
         verbose_name = 'Тег'
@@ -118,7 +174,7 @@ class Tag(models.Model):
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(CounterFieldsMixin, models.Model):
     name = models.CharField(
         verbose_name='Название',
         max_length=128,
@@ -129,6 +185,13 @@ class Ingredient(models.Model):
         max_length=64,
         help_text='Укажите единицу измерения'
     )
+    recipes_count = models.IntegerField(
+        verbose_name='Число рецептов',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('recipes_count',)
 
     class Meta:
         verbose_name = 'Продукт'
@@ -145,7 +208,7 @@ class Ingredient(models.Model):
         return f'{self.name}, ед.измерения - {self.measurement_unit}.'
 
 
-class Recipe(models.Model):
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         FoodgramUser,
         on_delete=models.CASCADE,
@@ -155,6 +218,11 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
     name = models.CharField(
         verbose_name='Название',
         max_length=MAX_RECIPE_NAME_LENGTH,
@@ -165,6 +233,12 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         help_text='Загрузите изображение рецепта'
     )
+    image_variants_source = models.CharField(
+        verbose_name='Изображение с готовыми копиями',
+        max_length=100,
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         verbose_name='Описание'
     )
@@ -186,12 +260,25 @@ class Recipe(models.Model):
             ),
         ]
     )
+    favorites_count = models.IntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('favorites_count',)
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
         default_related_name = 'recipes'
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            )
+        ]
 
     def __str__(self):
         return f'{self.name}. Автор - {self.author}.'
@@ -267,3 +354,165 @@ class ShoppingCart(UserRecipeBaseModel):
     class Meta(UserRecipeBaseModel.Meta):
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        FoodgramUser,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Продукт'
+    )
+    total = models.IntegerField(
+        verbose_name='Общее количество'
+    )
+
+    class Meta:
+        verbose_name = 'Продукт в списке покупок'
+        verbose_name_plural = 'Продукты в списках покупок'
+        default_related_name = 'shoppinglistitems'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_user_shoppinglistitem'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient.name} у {self.user}'
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        FoodgramUser,
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации рецепта'
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        default_related_name = 'timelineentries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_user_timelineentry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='timeline_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe.name} в ленте {self.user}'
+
+
+class RecipeNeighbour(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+        related_name='neighbours'
+    )
+    neighbour = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+        related_name='+'
+    )
+    score = models.FloatField(
+        verbose_name='Сходство'
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('recipe', 'neighbour'),
+                name='unique_recipe_neighbour'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('recipe', '-score'),
+                name='neighbour_recipe_score_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.neighbour.name} похож на {self.recipe.name}'
+
+
+class RecipeSearchDocument(models.Model):
+    """Поисковый документ рецепта на PostgreSQL.
+
+    Таблица и поддерживающие её триггеры создаются миграцией 0010
+    только на PostgreSQL, поэтому Django её не управляет.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        verbose_name='Рецепт',
+        related_name='search_document'
+    )
+    document = SearchVectorField(
+        verbose_name='Поисковый документ'
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_search'
+
+
+class Fts5DocumentField(models.TextField):
+    """Скрытый столбец FTS5 с именем таблицы: левая часть MATCH и первый
+    аргумент bm25()."""
+
+
+@Fts5DocumentField.register_lookup
+class Fts5Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+class RecipeFtsDocument(models.Model):
+    """Строка таблицы полнотекстового поиска FTS5 на SQLite."""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        verbose_name='Рецепт',
+        related_name='fts_document'
+    )
+    document = Fts5DocumentField(
+        db_column='recipes_recipe_fts',
+        verbose_name='Поисковый документ'
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'recipes_recipe_fts'
@@ -0,0 +1,68 @@
+"""Полнотекстовый поиск рецептов по названию, описанию и продуктам.
+
+Поисковый документ поддерживается триггерами (миграция 0010): на
+PostgreSQL - tsvector с русской морфологией и GIN-индексом, на SQLite -
+виртуальная таблица FTS5. FTS5 не умеет русскую морфологию, поэтому
+слова запроса ищутся по началу.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, FloatField, Func, Value
+
+from .models import Recipe, RecipeFtsDocument, RecipeSearchDocument
+
+# bm25 тем меньше, чем лучше совпадение; веса - название, описание
+# и продукты.
+FTS5_WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def to_fts5_query(query):
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
+
+
+def get_postgresql_query(query):
+    return SearchQuery(query, config='russian', search_type='websearch')
+
+
+def get_matching_ids(query):
+    """Подзапрос id рецептов, подходящих под поисковый запрос."""
+    if connection.vendor == 'postgresql':
+        return RecipeSearchDocument.objects.filter(
+            document=get_postgresql_query(query)
+        ).values('recipe_id')
+    if connection.vendor == 'sqlite':
+        return RecipeFtsDocument.objects.filter(
+            document__match=to_fts5_query(query)
+        ).values('recipe_id')
+    return Recipe.objects.filter(name__icontains=query).values('id')
+
+
+def search_recipes(recipes, query):
+    """Оставляет подходящие рецепты, самые релевантные - первыми.
+
+    Ранг берётся из той же строки поисковой таблицы, что и совпадение:
+    таблица присоединяется к рецептам, а не опрашивается подзапросом
+    для каждого рецепта.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = get_postgresql_query(query)
+        recipes = recipes.filter(
+            search_document__document=search_query
+        ).annotate(search_rank=SearchRank(
+            F('search_document__document'), search_query, cover_density=True
+        ))
+    elif connection.vendor == 'sqlite':
+        query = to_fts5_query(query)
+        if not query:
+            return recipes.none()
+        recipes = recipes.filter(
+            fts_document__document__match=query
+        ).annotate(search_rank=-Func(
+            F('fts_document__document'), *map(Value, FTS5_WEIGHTS),
+            function='bm25', output_field=FloatField()
+        ))
+    else:
+        return recipes.filter(id__in=get_matching_ids(query))
+    return recipes.order_by('-search_rank', '-pub_date', '-id')
@@ -0,0 +1,118 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db.models import Case, F, Sum, Value, When
+
+from .models import RecipeIngredient, ShoppingCart, ShoppingListItem
+
+SHOPPING_LIST_VERSION_KEY = 'shopping_list_version_{user_id}'
+
+
+def get_shopping_list_version(user_id):
+    return cache.get_or_set(
+        SHOPPING_LIST_VERSION_KEY.format(user_id=user_id), uuid4().hex, None
+    )
+
+
+def bump_shopping_list_versions(user_ids):
+    cache.set_many(
+        {
+            SHOPPING_LIST_VERSION_KEY.format(user_id=user_id): uuid4().hex
+            for user_id in user_ids
+        },
+        None
+    )
+
+
+def get_recipe_amounts(recipe_ids, sign=1):
+    return {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id').annotate(
+            amount=Sum('amount')
+        ).order_by()
+    }
+
+
+def update_shopping_list_items(user_ids, deltas):
+    """Прибавляет {id продукта: изменение} к спискам покупок пользователей.
+
+    Возвращает id пользователей, чьи списки изменились.
+    """
+    user_ids = list(user_ids)
+    deltas = {id: delta for id, delta in deltas.items() if delta}
+    if not user_ids or not deltas:
+        return []
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(user_id=user_id, ingredient_id=id, total=0)
+            for user_id in user_ids for id in deltas
+        ],
+        ignore_conflicts=True
+    )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=deltas
+    )
+    items.update(total=F('total') + Case(
+        *(When(ingredient_id=id, then=Value(delta))
+          for id, delta in deltas.items()),
+        default=Value(0)
+    ))
+    items.filter(total__lte=0).delete()
+    return user_ids
+
+
+def apply_shopping_list_deltas(user_ids, deltas):
+    bump_shopping_list_versions(update_shopping_list_items(user_ids, deltas))
+
+
+def apply_recipe_deltas(recipe_id, deltas):
+    """Применяет изменения продуктов рецепта ко всем корзинам с ним.
+
+    Версии списков не меняются: ключ кэша списка включает и версию данных
+    рецептов, которую сбрасывает само изменение рецепта. Иначе правка
+    популярного рецепта переписывала бы ключ каждого, у кого он в корзине.
+    """
+    if deltas:
+        update_shopping_list_items(
+            ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True),
+            deltas
+        )
+
+
+def calculate_shopping_lists(user_ids=None):
+    """Считает списки покупок заново по корзинам пользователей."""
+    carts = ShoppingCart.objects.all()
+    if user_ids is not None:
+        carts = carts.filter(user_id__in=user_ids)
+    return {
+        (item['user_id'], item['ingredient_id']): item['total']
+        for item in carts.values(
+            'user_id', ingredient_id=F('recipe__recipeingredients__ingredient')
+        ).annotate(
+            total=Sum('recipe__recipeingredients__amount')
+        ).order_by()
+        if item['ingredient_id'] is not None
+    }
+
+
+def rebuild_shopping_lists(user_ids=None):
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        items = items.filter(user_id__in=user_ids)
+    changed_user_ids = set(items.values_list('user_id', flat=True))
+    items.delete()
+    shopping_lists = calculate_shopping_lists(user_ids)
+    ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(user_id=user_id, ingredient_id=id, total=total)
+            for (user_id, id), total in shopping_lists.items()
+        ),
+        batch_size=1000
+    )
+    bump_shopping_list_versions(
+        changed_user_ids | {user_id for user_id, _ in shopping_lists}
+    )
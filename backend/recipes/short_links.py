@@ -0,0 +1,63 @@
+import string
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+# Перемешивание id умножением по модулю 2**40, чтобы соседние рецепты
+# не получали соседние коды. Множитель нечётный, поэтому обратим.
+ID_BITS = 40
+ID_MODULUS = 2 ** ID_BITS
+ID_MULTIPLIER = 0x5DEECE66D
+ID_INVERSE = pow(ID_MULTIPLIER, -1, ID_MODULUS)
+CHECKSUM_LENGTH = 2
+SALT = 'recipes.short_links'
+
+
+def to_base62(number):
+    digits = []
+    while True:
+        number, remainder = divmod(number, BASE)
+        digits.append(ALPHABET[remainder])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def from_base62(code):
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+
+def get_checksum(body):
+    digest = int.from_bytes(
+        salted_hmac(
+            SALT, body, secret=settings.SHORT_LINK_SECRET
+        ).digest()[:4],
+        'big'
+    )
+    return to_base62(digest % BASE ** CHECKSUM_LENGTH).rjust(
+        CHECKSUM_LENGTH, ALPHABET[0]
+    )
+
+
+def encode_recipe_id(recipe_id):
+    body = to_base62(recipe_id * ID_MULTIPLIER % ID_MODULUS)
+    return body + get_checksum(body)
+
+
+def decode_recipe_id(code):
+    """Возвращает id рецепта или None, если код неверный."""
+    body, checksum = code[:-CHECKSUM_LENGTH], code[-CHECKSUM_LENGTH:]
+    if (
+        not body
+        or any(char not in ALPHABET for char in code)
+        or get_checksum(body) != checksum
+    ):
+        return None
+    number = from_base62(body)
+    if number >= ID_MODULUS:
+        return None
+    return number * ID_INVERSE % ID_MODULUS
@@ -0,0 +1,247 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import Signal, receiver
+
+from .counters import change_counter
+from .feeds import backfill_timeline, prune_timeline, schedule_fan_out
+from .images import delete_variants, schedule_variants
+from .indexes import (
+    ingredient_prefix_index, ingredient_trigram_index, recipe_id_index,
+    recipe_ingredient_index
+)
+from .models import (
+    Favourite, FoodgramUser, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Subscription, Tag
+)
+from .shopping_lists import apply_shopping_list_deltas, get_recipe_amounts
+from .similarity import schedule_update
+
+# Отправляется после массовой загрузки справочника или рецептов
+# (bulk_create не вызывает post_save), sender - модель загруженных объектов.
+catalogue_imported = Signal()
+# Отправляется после массового добавления рецептов в избранное или корзину,
+# sender - модель, аргументы - user_id и recipe_ids добавленных рецептов.
+user_recipes_added = Signal()
+# То же после массового удаления (без pre_delete/post_delete по строкам).
+user_recipes_removed = Signal()
+# Отправляется после изменения состава продуктов рецепта через API
+# (bulk_create не вызывает post_save), sender - Recipe, аргумент - recipe_id.
+recipe_ingredients_changed = Signal()
+
+
+@receiver((post_save, post_delete, catalogue_imported), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_prefix_index.invalidate()
+    ingredient_trigram_index.invalidate()
+
+
+@receiver((post_save, post_delete, catalogue_imported), sender=Recipe)
+def invalidate_recipe_id_index(created=True, **kwargs):
+    # После коммита, чтобы другие процессы не успели перестроить индекс
+    # по старым данным.
+    if created:
+        transaction.on_commit(recipe_id_index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver((recipe_ingredients_changed, catalogue_imported), sender=Recipe)
+def invalidate_recipe_ingredient_index(**kwargs):
+    transaction.on_commit(recipe_ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_recipe_to_shopping_list(instance, created, **kwargs):
+    if created:
+        apply_shopping_list_deltas(
+            (instance.user_id,), get_recipe_amounts((instance.recipe_id,))
+        )
+
+
+@receiver(user_recipes_added, sender=ShoppingCart)
+def add_recipes_to_shopping_list(user_id, recipe_ids, **kwargs):
+    apply_shopping_list_deltas((user_id,), get_recipe_amounts(recipe_ids))
+
+
+@receiver(user_recipes_removed, sender=ShoppingCart)
+def remove_recipes_from_shopping_list(user_id, recipe_ids, **kwargs):
+    apply_shopping_list_deltas(
+        (user_id,), get_recipe_amounts(recipe_ids, sign=-1)
+    )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_recipe_from_shopping_list(instance, **kwargs):
+    apply_shopping_list_deltas(
+        (instance.user_id,), get_recipe_amounts((instance.recipe_id,), sign=-1)
+    )
+
+
+IMAGE_FIELDS = {Recipe: 'image', FoodgramUser: 'avatar'}
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=FoodgramUser)
+def remember_previous_image(sender, instance, update_fields, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    instance.previous_image_name = None
+    if not instance._state.adding and (
+        update_fields is None or field in update_fields
+    ):
+        instance.previous_image_name = sender.objects.filter(
+            pk=instance.pk
+        ).values_list(field, flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=FoodgramUser)
+def replace_image_variants(sender, instance, update_fields, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    if update_fields is not None and field not in update_fields:
+        return
+    name = getattr(instance, field).name
+    previous_name = getattr(instance, 'previous_image_name', None)
+    if name and name != getattr(instance, f'{field}_variants_source'):
+        transaction.on_commit(lambda: schedule_variants(name))
+    if previous_name and previous_name != name:
+        transaction.on_commit(lambda: delete_variants(previous_name))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=FoodgramUser)
+def delete_image_variants(sender, instance, **kwargs):
+    name = getattr(instance, IMAGE_FIELDS[sender]).name
+    if name:
+        transaction.on_commit(lambda: delete_variants(name))
+
+
+def get_delta(signal, created):
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def count_recipes(signal, instance, created=False, **kwargs):
+    change_counter(
+        FoodgramUser, instance.author_id, 'recipes_count',
+        get_delta(signal, created)
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def uncount_recipe_tags(instance, **kwargs):
+    # Связи с тегами удаляются каскадом без сигнала m2m_changed.
+    Tag.objects.filter(recipes=instance).update(
+        recipes_count=F('recipes_count') - 1
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def count_tag_recipes(instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            change_counter(
+                Tag, instance.id, 'recipes_count', -instance.recipes.count()
+            )
+        else:
+            uncount_recipe_tags(instance)
+    elif action in ('post_add', 'post_remove'):
+        delta = 1 if action == 'post_add' else -1
+        if reverse:
+            change_counter(
+                Tag, instance.id, 'recipes_count', delta * len(pk_set)
+            )
+        else:
+            change_counter(Tag, pk_set, 'recipes_count', delta)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_previous_ingredient(instance, **kwargs):
+    # Продукт существующей строки можно сменить в админке.
+    instance.previous_ingredient_id = None
+    if not instance._state.adding:
+        instance.previous_ingredient_id = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', flat=True).first()
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def count_ingredient_recipes(signal, instance, created=False, **kwargs):
+    previous_id = getattr(instance, 'previous_ingredient_id', None)
+    if signal is post_save and previous_id not in (
+        None, instance.ingredient_id
+    ):
+        change_counter(Ingredient, previous_id, 'recipes_count', -1)
+        change_counter(Ingredient, instance.ingredient_id, 'recipes_count', 1)
+        return
+    change_counter(
+        Ingredient, instance.ingredient_id, 'recipes_count',
+        get_delta(signal, created)
+    )
+
+
+@receiver((post_save, post_delete), sender=Favourite)
+def count_favorites(signal, instance, created=False, **kwargs):
+    change_counter(
+        Recipe, instance.recipe_id, 'favorites_count',
+        get_delta(signal, created)
+    )
+
+
+@receiver(user_recipes_added, sender=Favourite)
+def count_bulk_favorites(recipe_ids, **kwargs):
+    change_counter(Recipe, recipe_ids, 'favorites_count', 1)
+
+
+@receiver(user_recipes_removed, sender=Favourite)
+def uncount_bulk_favorites(recipe_ids, **kwargs):
+    change_counter(Recipe, recipe_ids, 'favorites_count', -1)
+
+
+@receiver((post_save, post_delete), sender=Subscription)
+def count_subscriptions(signal, instance, created=False, **kwargs):
+    delta = get_delta(signal, created)
+    change_counter(
+        FoodgramUser, instance.author_id, 'subscribers_count', delta
+    )
+    change_counter(
+        FoodgramUser, instance.subscriber_id, 'subscriptions_count', delta
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_new_recipe(instance, created, **kwargs):
+    if created:
+        schedule_fan_out(instance)
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_subscriber_timeline(instance, created, **kwargs):
+    if created:
+        backfill_timeline(instance.subscriber_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def prune_subscriber_timeline(instance, **kwargs):
+    prune_timeline(instance.subscriber_id, instance.author_id)
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def update_similar_recipes(recipe_id, **kwargs):
+    schedule_update((recipe_id,))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def update_similar_recipes_on_ingredient(instance, **kwargs):
+    schedule_update((instance.recipe_id,))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_similar_recipes_on_tags(instance, action, reverse, pk_set,
+                                   **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    schedule_update((pk_set or ()) if reverse else (instance.id,))
@@ -0,0 +1,269 @@
+"""Похожие рецепты по косинусной мере над наборами продуктов и тегов.
+
+Рецепты - строки разреженных бинарных матриц продуктов и тегов.
+Кандидаты в соседи - рецепты с общими редкими продуктами: продукты из
+более чем SIMILARITY_MAX_INGREDIENT_RECIPES рецептов (соль, вода)
+связывают почти все рецепты и кандидатов не дают, хотя учитываются в
+сходстве. Поэтому время и память пересчёта растут линейно с числом
+рецептов. Рецепт только из частых продуктов соседей не получает.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, local
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from scipy import sparse
+
+from .constants import (
+    SIMILAR_RECIPES_COUNT, SIMILARITY_BATCH_SIZE, SIMILARITY_CANDIDATES,
+    SIMILARITY_MAX_INGREDIENT_RECIPES
+)
+from .models import Ingredient, Recipe, RecipeIngredient, RecipeNeighbour
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='similarity')
+# Рецепты, пересчёт которых уже поставлен в очередь.
+queued_ids = set()
+queued_lock = Lock()
+# Рецепты, изменённые в текущей транзакции потока.
+pending = local()
+
+
+def load_pairs(queryset, field, recipe_ids=None):
+    if recipe_ids is not None:
+        queryset = queryset.filter(recipe_id__in=recipe_ids)
+    return np.array(
+        list(queryset.values_list('recipe_id', field).iterator()),
+        dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def to_matrix(pairs, recipe_ids):
+    """Бинарная матрица рецепты x признаки из пар (id рецепта, признак)."""
+    _, columns = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (
+            np.ones(len(pairs), dtype=np.float32),
+            (np.searchsorted(recipe_ids, pairs[:, 0]), columns.ravel())
+        ),
+        shape=(len(recipe_ids), columns.max() + 1 if len(pairs) else 0)
+    )
+    matrix.data[:] = 1
+    return matrix
+
+
+def load_features(recipe_ids=None):
+    """Возвращает id рецептов, матрицу редких продуктов, матрицу всех
+    признаков (продукты и теги) и число признаков каждого рецепта."""
+    ingredients = load_pairs(
+        RecipeIngredient.objects.all(), 'ingredient_id', recipe_ids
+    )
+    tags = load_pairs(
+        Recipe.tags.through.objects.all(), 'tag_id', recipe_ids
+    )
+    common_ids = list(Ingredient.objects.filter(
+        recipes_count__gt=SIMILARITY_MAX_INGREDIENT_RECIPES
+    ).values_list('id', flat=True))
+    ids = np.union1d(ingredients[:, 0], tags[:, 0])
+    rare = to_matrix(
+        ingredients[~np.isin(ingredients[:, 1], common_ids)], ids
+    )
+    features = sparse.hstack(
+        (to_matrix(ingredients, ids), to_matrix(tags, ids))
+    ).tocsr()
+    return ids, rare, features, np.diff(features.indptr)
+
+
+def find_candidates(rows, rare, sizes):
+    """Возвращает пары строк (рецепт, кандидат) для строк rows.
+
+    Кандидаты - до SIMILARITY_CANDIDATES рецептов с наибольшим числом
+    общих редких продуктов, делённым на корень из числа признаков
+    кандидата, как в косинусной мере.
+    """
+    shared = (rare[rows] @ rare.T).tocsr()
+    sources, targets = [], []
+    for position, row in enumerate(rows):
+        start, end = shared.indptr[position:position + 2]
+        columns = shared.indices[start:end]
+        counts = shared.data[start:end]
+        other = columns != row
+        columns, counts = columns[other], counts[other]
+        if len(columns) > SIMILARITY_CANDIDATES:
+            columns = columns[np.argpartition(
+                -counts / np.sqrt(sizes[columns]), SIMILARITY_CANDIDATES
+            )[:SIMILARITY_CANDIDATES]]
+        sources.append(np.full(len(columns), row))
+        targets.append(columns)
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def find_neighbours(rows, ids, rare, features, sizes):
+    """Возвращает тройки (id рецепта, id соседа, сходство) для строк rows
+    (по возрастанию).
+
+    У каждого рецепта до SIMILAR_RECIPES_COUNT соседей: по убыванию
+    сходства, при равенстве - по возрастанию id.
+    """
+    if not len(rows):
+        return
+    sources, targets = find_candidates(rows, rare, sizes)
+    overlaps = np.asarray(
+        features[sources].multiply(features[targets]).sum(axis=1)
+    ).ravel()
+    scores = overlaps / np.sqrt(
+        sizes[sources] * sizes[targets].astype(np.float64)
+    )
+    bounds = np.searchsorted(sources, rows, side='right')
+    start = 0
+    for row, end in zip(rows, bounds):
+        columns, row_scores = targets[start:end], scores[start:end]
+        start = end
+        order = np.lexsort(
+            (ids[columns], -row_scores)
+        )[:SIMILAR_RECIPES_COUNT]
+        recipe_id = int(ids[row])
+        for neighbour_id, score in zip(
+            ids[columns[order]].tolist(), row_scores[order].tolist()
+        ):
+            yield recipe_id, neighbour_id, score
+
+
+def rebuild_neighbours(progress=None):
+    """Пересчитывает таблицу похожих рецептов целиком."""
+    ids, rare, features, sizes = load_features()
+    with transaction.atomic():
+        RecipeNeighbour.objects.all().delete()
+        for start in range(0, len(ids), SIMILARITY_BATCH_SIZE):
+            rows = np.arange(
+                start, min(len(ids), start + SIMILARITY_BATCH_SIZE)
+            )
+            RecipeNeighbour.objects.bulk_create(
+                RecipeNeighbour(
+                    recipe_id=recipe_id, neighbour_id=neighbour_id,
+                    score=score
+                )
+                for recipe_id, neighbour_id, score in find_neighbours(
+                    rows, ids, rare, features, sizes
+                )
+            )
+            if progress:
+                progress(start + len(rows), len(ids))
+    return len(ids)
+
+
+def trim_neighbours(recipe_ids):
+    """Оставляет рецептам по SIMILAR_RECIPES_COUNT лучших соседей."""
+    if not recipe_ids:
+        return
+    ranked_sql, params = RecipeNeighbour.objects.filter(
+        recipe_id__in=recipe_ids
+    ).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('recipe_id')],
+            order_by=[F('score').desc(), F('neighbour_id').asc()]
+        )
+    ).order_by().values('id', 'row_number').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM '
+            f'{connection.ops.quote_name(RecipeNeighbour._meta.db_table)} '
+            f'WHERE id IN (SELECT id FROM ({ranked_sql}) ranked '
+            'WHERE row_number > %s)',
+            (*params, SIMILAR_RECIPES_COUNT)
+        )
+
+
+def update_batch_neighbours(recipe_ids):
+    candidate_ids = set(
+        RecipeIngredient.objects.filter(
+            ingredient_id__in=RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids,
+                ingredient__recipes_count__lte=(
+                    SIMILARITY_MAX_INGREDIENT_RECIPES
+                )
+            ).values('ingredient_id')
+        ).values_list('recipe_id', flat=True)
+    )
+    scores = {}
+    if candidate_ids & recipe_ids:
+        ids, rare, features, sizes = load_features(candidate_ids)
+        for recipe_id, neighbour_id, score in find_neighbours(
+            np.searchsorted(ids, sorted(candidate_ids & recipe_ids)),
+            ids, rare, features, sizes
+        ):
+            scores[recipe_id, neighbour_id] = score
+            scores[neighbour_id, recipe_id] = score
+    with transaction.atomic():
+        existing_ids = set(
+            Recipe.objects.select_for_update().filter(
+                id__in={id for pair in scores for id in pair} | recipe_ids
+            ).order_by('id').values_list('id', flat=True)
+        )
+        RecipeNeighbour.objects.filter(
+            Q(recipe_id__in=recipe_ids) | Q(neighbour_id__in=recipe_ids)
+        ).delete()
+        RecipeNeighbour.objects.bulk_create(
+            RecipeNeighbour(
+                recipe_id=recipe_id, neighbour_id=neighbour_id, score=score
+            )
+            for (recipe_id, neighbour_id), score in scores.items()
+            if recipe_id in existing_ids and neighbour_id in existing_ids
+        )
+        trim_neighbours({recipe_id for recipe_id, _ in scores})
+
+
+def update_neighbours(recipe_ids):
+    """Пересчитывает соседей рецептов и обратные связи с ними.
+
+    Рецепты, потерявшие эти рецепты в соседях, дополняются только при
+    полном пересчёте. Рецепты и их соседи могут быть удалены, пока идёт
+    расчёт: перед записью они блокируются и проверяются.
+    """
+    recipe_ids = sorted(recipe_ids)
+    for start in range(0, len(recipe_ids), SIMILARITY_BATCH_SIZE):
+        batch = set(recipe_ids[start:start + SIMILARITY_BATCH_SIZE])
+        try:
+            update_batch_neighbours(batch)
+        except Exception:
+            logger.exception(
+                'Не удалось обновить похожие рецепты %s', sorted(batch)
+            )
+
+
+def update_queued_neighbours():
+    with queued_lock:
+        recipe_ids = set(queued_ids)
+        queued_ids.clear()
+    update_neighbours(recipe_ids)
+
+
+def submit_pending_updates():
+    recipe_ids = getattr(pending, 'ids', None)
+    if not recipe_ids:
+        return
+    pending.ids = set()
+    with queued_lock:
+        # Уже поставленная задача заберёт и эти рецепты.
+        submitted = bool(queued_ids)
+        queued_ids.update(recipe_ids)
+    if not submitted:
+        run_in_background(executor, update_queued_neighbours)
+
+
+def schedule_update(recipe_ids):
+    """Пересчитывает соседей рецептов после коммита транзакции.
+
+    Рецепты, изменённые в одной транзакции, пересчитываются вместе и по
+    одному разу, сколько бы строк продуктов и тегов ни изменилось.
+    """
+    if not hasattr(pending, 'ids'):
+        pending.ids = set()
+    pending.ids.update(recipe_ids)
+    transaction.on_commit(submit_pending_updates)
@@ -0,0 +1,29 @@
+"""Фоновая работа после коммита транзакции.
+
+На PostgreSQL она уходит в пул потоков. SQLite не допускает
+одновременной записи: запись из фонового потока приводит к
+"database is locked" в запросах, поэтому на SQLite работа выполняется
+сразу, в том же потоке.
+"""
+import logging
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_worker(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой', func)
+    finally:
+        connection.close()
+
+
+def run_in_background(executor, func, *args):
+    """Выполняет func в executor, а на SQLite - сразу."""
+    if connection.vendor == 'sqlite':
+        func(*args)
+    else:
+        executor.submit(run_in_worker, func, *args)
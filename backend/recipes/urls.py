@@ -3,5 +3,5 @@ from django.urls import path
 from .views import redirection
 
 urlpatterns = [
-    path('<int:id>', redirection),
+    path('<slug:code>', redirection),
 ]
@@ -1,12 +1,19 @@
-from django.core.exceptions import ValidationError
+from django.http import Http404
 from django.shortcuts import redirect
 
-from .models import Recipe
+from .indexes import recipe_id_index
+from .short_links import decode_recipe_id
 
 
-def redirection(request, id):
-    if not Recipe.objects.filter(id=id).exists():
-        raise ValidationError(
-            f'Рецепта не существует, id - {id}'
-        )
-    return redirect(request.build_absolute_uri(f'/recipes/{id}'))
+def redirection(request, code):
+    recipe_ids = [decode_recipe_id(code)]
+    if code.isdigit():
+        # Ссылки вида /s/<id>, выданные до перехода на короткие коды.
+        # Часть чисел - ещё и верные коды, поэтому проверяются оба id.
+        recipe_ids.append(int(code))
+    for recipe_id in recipe_ids:
+        if recipe_id is not None and recipe_id_index.exists(recipe_id):
+            return redirect(
+                request.build_absolute_uri(f'/recipes/{recipe_id}')
+            )
+    raise Http404(f'Рецепта не существует, код - {code}')